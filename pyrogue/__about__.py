@@ -60,6 +60,7 @@ install_requires = [
 ]
 extras_require   = {
     'splash': ['pygame'],
+    'fast':   ['numpy'],
 }
 readme           = "README.md"
 project_urls     = {"Bug Tracker": __url__ + "/issues", "Source Code": __url__}
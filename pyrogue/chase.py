@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+#    Copyright (C) 2015 Rodrigo Silva (MestreLion) <linux@rodrigosilva.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+'''
+Monster chasing: distance maps toward a target, such as the player
+
+A DistanceMap holds the number of steps from every cell to the target,
+by breadth-first search over walkable cells, moving in 8 directions like
+the player does. It is computed once per target position and shared by
+all chasing monsters, which then pick their next step in O(1).
+
+Cells are stored in flat arrays padded with a border of unwalkable cells,
+so neighbours are fixed index offsets and need no bounds checks.
+'''
+
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+FAR = 0xFFFF  # Distance of unreachable cells
+
+# (row, col) deltas of neighbour cells
+DIRECTIONS = ((-1, -1), (-1, 0), (-1, 1),
+              ( 0, -1),          ( 0, 1),
+              ( 1, -1), ( 1, 0), ( 1, 1))
+
+
+class DistanceMap(object):
+    def __init__(self, walkable, size):
+        '''<walkable>: flat row-major sequence, non-zero for walkable cells,
+            such as the bytearray of Level.mask(FLAG.WALKABLE)
+        '''
+        self.rows, self.cols = size
+        self.width = self.cols + 2
+        self.target = None
+
+        self.walkable = bytearray(self.width * (self.rows + 2))
+        self.dist = array.array('H', [FAR]) * len(self.walkable)
+        self.set_walkable(walkable)
+
+        # Index offsets of neighbour cells, and their (row, col) deltas
+        self.neighbours = tuple(dr * self.width + dc for dr, dc in DIRECTIONS)
+        self.moves = tuple(zip(self.neighbours, DIRECTIONS))
+
+    def update(self, target):
+        '''Make target (row, col) the distance origin, recomputing only if
+            it moved. Return True if recomputed
+        '''
+        if target == self.target:
+            return False
+        self.target = target
+        self.compute()
+        return True
+
+    def set_walkable(self, walkable):
+        '''Set new walkable flags, as when a door opens, and force
+            recomputation on next update()
+        '''
+        for row in range(self.rows):
+            offset = (row + 1) * self.width + 1
+            self.walkable[offset:offset + self.cols] = bytes(
+                walkable[row * self.cols:(row + 1) * self.cols])
+        self.target = None
+
+    def compute(self):
+        '''Breadth-first search from target, one frontier at a time'''
+        dist = self.dist
+        walkable = self.walkable
+        neighbours = self.neighbours
+        dist[:] = array.array('H', [FAR]) * len(dist)
+
+        start = self._index(*self.target)
+        dist[start] = 0
+        frontier = [start]
+        steps = 0
+        while frontier:
+            steps += 1
+            nextfrontier = []
+            for cell in frontier:
+                for offset in neighbours:
+                    n = cell + offset
+                    if walkable[n] and dist[n] == FAR:
+                        dist[n] = steps
+                        nextfrontier.append(n)
+            frontier = nextfrontier
+
+    def distance(self, row, col):
+        '''Steps from (row, col) to target, FAR if unreachable'''
+        return self.dist[self._index(row, col)]
+
+    def step(self, row, col, blocked=()):
+        '''Next (row, col) of a shortest path to target, or None if already
+            there or unreachable. Cells in <blocked>, such as those taken by
+            other monsters, are avoided
+        '''
+        here = self._index(row, col)
+        best, bestdist = None, self.dist[here]
+        for offset, (dr, dc) in self.moves:
+            d = self.dist[here + offset]
+            if d < bestdist:
+                pos = (row + dr, col + dc)
+                if pos not in blocked:
+                    best, bestdist = pos, d
+        return best
+
+    def array(self):
+        '''Zero-copy (rows, cols) NumPy array of distances, if available'''
+        if numpy is None:
+            raise ImportError("NumPy is required for DistanceMap.array()")
+        padded = numpy.frombuffer(self.dist, dtype=numpy.uint16).reshape(
+            (self.rows + 2, self.width))
+        return padded[1:-1, 1:-1]
+
+    def _index(self, row, col):
+        return (row + 1) * self.width + col + 1
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+#    Copyright (C) 2015 Rodrigo Silva (MestreLion) <linux@rodrigosilva.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+'''
+Daemons and fuses: actions run by the game clock, as in DOS daemons.c
+
+Daemons run every <period> turns, such as healing and digestion.
+Fuses run once, after <delay> turns, such as waking up or a potion wearing
+off. Both are known by name, so they can be saved and extinguished.
+
+Events are kept in a heap ordered by due turn, so running a turn costs only
+the events actually due, and finding the next one is O(1). Events due on the
+same turn run in the order they were first registered, always.
+
+Daemons running every turn may also be batched: given (horizon, apply)
+functions, idle() finds how many upcoming turns have nothing due but batched
+daemons with no effect other than their closed-form apply(), and batch()
+jumps over them, so long rests cost only the turns where something happens.
+'''
+
+import heapq
+
+
+class Scheduler(object):
+    def __init__(self):
+        self.turn = 0
+        self.callbacks = {}  # name: (callback, order)
+        self.batches = {}    # name: (horizon, apply), see daemon()
+        self.queue = []      # heap of [due turn, order, name, period]
+
+    def register(self, name, callback):
+        '''Set the callback run by events <name>, without scheduling it
+            Registration order is the run order of events due together
+        '''
+        order = self.callbacks[name][1] if name in self.callbacks else \
+            len(self.callbacks)
+        self.callbacks[name] = (callback, order)
+
+    def daemon(self, name, callback, period=1, delay=None, batch=None):
+        '''Run <callback> every <period> turns, starting in <delay> turns,
+            by default <period>
+
+            <batch>: for daemons running every turn, a (horizon, apply) pair
+            of functions: horizon(n) returns how many of the next n runs,
+            in a row, would have no effect other than a closed-form
+            apply(k) for k runs, such as depleting food. See idle()
+        '''
+        self.register(name, callback)
+        self.batches.pop(name, None)
+        if batch is not None and period == 1:
+            self.batches[name] = batch
+        self._schedule(name, period if delay is None else delay, period)
+
+    def fuse(self, name, callback, delay):
+        '''Run <callback> once, in <delay> turns'''
+        self.register(name, callback)
+        self._schedule(name, delay, 0)
+
+    def extinguish(self, name):
+        '''Unschedule all events <name>'''
+        self.queue = [_ for _ in self.queue if _[2] != name]
+        heapq.heapify(self.queue)
+
+    def lengthen(self, name, turns):
+        '''Postpone events <name> by <turns>, as DOS lengthen() for fuses'''
+        for event in self.queue:
+            if event[2] == name:
+                event[0] += turns
+        heapq.heapify(self.queue)
+
+    def next_due(self):
+        '''Turn of the next scheduled event, or None if there are none'''
+        return self.queue[0][0] if self.queue else None
+
+    def idle(self, limit):
+        '''How many of the next turns, up to <limit>, can be batch()ed:
+            turns with only batched daemons due, within all their horizons
+        '''
+        turns = limit
+        batched = []
+        for event in self.queue:
+            if self._batched(event):
+                batched.append(event[2])
+            else:
+                turns = min(turns, event[0] - self.turn - 1)
+        for name in batched:
+            if turns < 1:
+                break
+            turns = min(turns, self.batches[name][0](turns))
+        return max(turns, 0)
+
+    def batch(self, turns):
+        '''Advance the clock <turns> turns in closed form, which must be
+            at most idle(). Same as run() on each of those turns
+        '''
+        if turns < 1:
+            return
+        for event in [_ for _ in sorted(self.queue) if self._batched(_)]:
+            event[0] += turns
+            self.batches[event[2]][1](turns)
+        heapq.heapify(self.queue)
+        self.turn += turns
+
+    def run(self, turn):
+        '''Advance the clock to <turn> and run all events due by then'''
+        self.turn = turn
+        queue = self.queue
+        while queue and queue[0][0] <= turn:
+            event = heapq.heappop(queue)
+            due, order, name, period = event
+            if period:
+                # Reschedule first, so a callback may extinguish it
+                event[0] = due + period
+                heapq.heappush(queue, event)
+            self.callbacks[name][0]()
+
+    def get_state(self):
+        '''Scheduled events, JSON-serializable, for set_state()'''
+        return {'turn': self.turn,
+                'queue': [[due, name, period]
+                          for due, __, name, period in sorted(self.queue)]}
+
+    def set_state(self, state):
+        '''Restore events from get_state(). All names must be registered'''
+        self.turn = state['turn']
+        self.queue = [[due, self.callbacks[name][1], name, period]
+                      for due, name, period in state['queue']]
+        heapq.heapify(self.queue)
+
+    def _batched(self, event):
+        '''If event is a batched daemon due next turn, so idle() and batch()
+            agree. Others, such as delayed ones, are not batched yet
+        '''
+        due, __, name, period = event
+        return name in self.batches and period == 1 and due == self.turn + 1
+
+    def _schedule(self, name, delay, period):
+        heapq.heappush(self.queue, [self.turn + delay,
+                                    self.callbacks[name][1], name, period])
@@ -26,34 +26,75 @@ __all__ = ['Enum']  # not necessary as Enum is the only non-__*__ name
 import sys
 
 class _meta(type):
+    def _cache(self):
+        '''
+        Return the member tables of this class, built on first use and
+        discarded when a public attribute is set or deleted
+        '''
+        try:
+            return self.__dict__['_enum_cache']
+        except KeyError:
+            pass
+
+        members = {k: v for k, v in self.__dict__.items()
+                   if  not k.startswith("_")
+                   and not self._callable(getattr(self, k))}
+
+        # Reverse index, value => first member name. Unhashable values,
+        # such as sets, are left out and searched linearly by name()
+        names = {}
+        for k, v in members.items():
+            try:
+                names.setdefault(v, k)
+            except TypeError:
+                pass
+
+        cache = {'members': members, 'names': names, 'values': None}
+        type.__setattr__(self, '_enum_cache', cache)
+        return cache
+
+    def _values(self):
+        '''Member values sorted by value, cached'''
+        cache = self._cache()
+        if cache['values'] is None:
+            cache['values'] = tuple(sorted(cache['members'].values()))
+        return cache['values']
+
+    def __setattr__(self, k, v):
+        type.__setattr__(self, k, v)
+        if not k.startswith("_") and '_enum_cache' in self.__dict__:
+            type.__delattr__(self, '_enum_cache')
+
+    def __delattr__(self, k):
+        type.__delattr__(self, k)
+        if not k.startswith("_") and '_enum_cache' in self.__dict__:
+            type.__delattr__(self, '_enum_cache')
+
     @property
     def __members__(self):
-        return {k: v for k, v in self.__dict__.items()
-                if  not k.startswith("_")
-                and not self._callable(getattr(self, k))}
+        return dict(self._cache()['members'])
 
     def __iter__(self):
         '''Yield members sorted by value, not declaration order'''
-        return iter(sorted(self.__members__.values()))
+        return iter(self._values())
 
     def __reversed__(self):
         '''Yield members sorted by descending value order'''
-        return reversed(tuple(self))
-        # tuple() is required to create a sequence out of the Enum
+        return reversed(self._values())
 
     def __getitem__(self, k):
         try:
-            return self.__members__[k]
+            return self._cache()['members'][k]
         except KeyError:
             # re-raise as AttributeError, for consistency with Enum.VALUE
             raise AttributeError("type object '{}' has no attribute '{}'".
                                  format(self.__name__, k))
 
     def __contains__(self, k):
-        return k in self.__members__
+        return k in self._cache()['members']
 
     def __len__(self):
-        return len(self.__members__)
+        return len(self._cache()['members'])
 
 
 class _base(object):
@@ -76,9 +117,16 @@ class _base(object):
         Enums can customize member names by overriding this method
         '''
         # value not handled in subclass name()
-        for k, v in cls.__members__.items():
-            if v == value:
-                return k.replace('_', ' ').title()
+        cache = cls._cache()
+        try:
+            k = cache['names'].get(value)
+        except TypeError:  # unhashable value
+            k = None
+        if k is None:
+            k = next((k for k, v in cache['members'].items() if v == value),
+                     None)
+        if k is not None:
+            return k.replace('_', ' ').title()
 
         # Value not find. Try again using value as member name.
         # Allows usage as Enum.name("VALUE") besides Enum.name(Enum.VALUE)
@@ -90,7 +138,8 @@ class _base(object):
         Return a list of member attribute names (strings),
         ordered by value to make it consistent with class iterator
         '''
-        return sorted(cls.__members__, key=cls.__members__.get)
+        members = cls._cache()['members']
+        return sorted(members, key=members.get)
 
 
 # Python 2
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+#    Copyright (C) 2015 Rodrigo Silva (MestreLion) <linux@rodrigosilva.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+'''
+Field of view by recursive shadowcasting
+
+The map is scanned in 8 octants around the viewer, row by row outwards.
+An opaque cell casts a shadow, an arc of slopes that is skipped on farther
+rows, and scanning of the rest of the row continues in a recursive call.
+Each visible cell is visited exactly once.
+
+Opacity is a flat, row-major sequence with a non-zero value for cells
+that block sight, such as the bytearray of Level.mask(FLAG.BLOCKS_SIGHT).
+Opaque cells are visible themselves, so walls are seen.
+'''
+
+
+# Transforms from octant-relative (dx, dy) to map (col, row) deltas,
+# as (xx, xy, yx, yy) for each octant
+OCTANTS = (
+    ( 1,  0,  0,  1),
+    ( 0,  1,  1,  0),
+    ( 0, -1,  1,  0),
+    (-1,  0,  0,  1),
+    (-1,  0,  0, -1),
+    ( 0, -1, -1,  0),
+    ( 0,  1, -1,  0),
+    ( 1,  0,  0, -1),
+)
+
+
+def shadowcast(opaque, size, origin, radius):
+    '''Return the set of (row, col) cells visible from <origin>, up to
+        <radius> cells away in any direction, so a square area
+    '''
+    visible = {origin}
+    for transform in OCTANTS:
+        _cast(opaque, size, origin, radius, transform, 1, 1.0, 0.0, visible)
+    return visible
+
+
+def _cast(opaque, size, origin, radius, transform, start, high, low, visible):
+    '''Scan an octant from distance <start> outwards, between slopes <high>
+        and <low>, adding visible cells
+    '''
+    if high < low:
+        return
+
+    rows, cols = size
+    orow, ocol = origin
+    xx, xy, yx, yy = transform
+
+    for distance in range(start, radius + 1):
+        blocked = False
+        nexthigh = high
+        dy = -distance
+        for dx in range(-distance, 1):
+            # Slopes of the cell edges, as seen from the origin
+            lslope = (dx - 0.5) / (dy + 0.5)
+            rslope = (dx + 0.5) / (dy - 0.5)
+            if high < rslope:
+                continue
+            if low > lslope:
+                break
+
+            col = ocol + dx * xx + dy * xy
+            row = orow + dx * yx + dy * yy
+            inside = 0 <= row < rows and 0 <= col < cols
+            if inside:
+                visible.add((row, col))
+            wall = not inside or opaque[row * cols + col]
+
+            if blocked:
+                if wall:
+                    nexthigh = rslope
+                    continue
+                blocked = False
+                high = nexthigh
+            elif wall and distance < radius:
+                # Scan the lit part beyond the wall, then skip its shadow
+                blocked = True
+                _cast(opaque, size, origin, radius, transform,
+                      distance + 1, high, lslope, visible)
+                nexthigh = rslope
+
+        if blocked:
+            break
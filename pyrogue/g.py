@@ -47,3 +47,5 @@ AMULETLEVEL = 5  # Level Amulet starts appearing @for now
 class GameError(Exception): pass
 class Win(GameError): pass
 class Lose(GameError): pass
+class NoInput(GameError): pass  # No more keys to replay
+class Save(GameError): pass  # Save and quit
@@ -17,14 +17,23 @@
 
 '''Game load and play'''
 
+import os.path
 import string
 import logging
+import collections
+import threading
+import zlib
 
 from . import g
 from . import input
 from . import rnd
 from . import enum2 as enum
-from . import things
+from . import grid
+from . import fov
+from . import chase
+from . import daemons
+from . import headless
+from . import savegame as save
 
 from .player import Player
 
@@ -33,6 +42,21 @@ log = logging.getLogger(__name__)
 
 MAXLEVEL = 99  # No such restriction in DOS
 
+# The RNG period is partitioned in slots of LEVELDRAWS draws. The game stream,
+# shared with the player, starts at the initial seed and owns the first
+# GAMESLOTS slots. Each level owns the slot after those for its depth, so no
+# stream ever overlaps another. See Level.__init__()
+GAMESLOTS  = MAXLEVEL + 1
+LEVELDRAWS = rnd.PERIOD // (GAMESLOTS + MAXLEVEL)
+
+MAXROOMS = 9   # In a 3 x 3 grid
+MAXTRAPS = 10
+
+# Rooms adjacent to each room in the grid, the ones corridors may connect
+NEIGHBOURS = tuple(tuple(j for j in range(MAXROOMS)
+                         if abs(i // 3 - j // 3) + abs(i % 3 - j % 3) == 1)
+                   for i in range(MAXROOMS))
+
 
 class TILE(enum.Enum):
     # FEATURES
@@ -112,14 +136,153 @@ class TILE(enum.Enum):
 [setattr(TILE, __, __) for __ in string.ascii_uppercase]
 
 
+class FLAG(enum.Enum):
+    '''Tile properties, as bits in TILEFLAGS'''
+    WALKABLE     = 0x01  # Can walk on
+    PICKUP       = 0x02  # Can pick up
+    DROPPABLE    = 0x04  # Can drop things on
+    BLOCKS_SIGHT = 0x08  # Opaque, can not see through
+    FIGHT        = 0x10  # Walking on initiates a fight
+
+
+def _tileflags():
+    '''Build the tile code to flags table from TILE rules'''
+    table = bytearray(256)
+    for tiles, flags in ((TILE.FEATURE, FLAG.WALKABLE),
+                         (TILE.OBJECT,  FLAG.WALKABLE | FLAG.PICKUP),
+                         (TILE.PASSAGE, FLAG.WALKABLE | FLAG.DROPPABLE),
+                         (TILE.WALL,    FLAG.BLOCKS_SIGHT),
+                         (TILE.MONSTER, FLAG.FIGHT)):
+        for tile in tiles:
+            table[grid.code(tile)] |= flags
+    return bytes(table)
+
+# Flags of each tile, indexed by tile code
+TILEFLAGS = _tileflags()
+
+
+def tileflags(char):
+    '''Flags of a tile char'''
+    return TILEFLAGS[grid.code(char)]
+
+
+def flagmask(flag):
+    '''Return a 256-byte table mapping tile codes to 1 if they have any of
+        the given flags, 0 otherwise. For use with Grid.translate()
+    '''
+    return bytes(1 if flags & flag else 0 for flags in TILEFLAGS)
+
+
+# Direction of each input.MOVE, as (row, col) deltas
+DIRECTIONS = {
+    'UP':         (-1,  0),
+    'DOWN':       ( 1,  0),
+    'LEFT':       ( 0, -1),
+    'RIGHT':      ( 0,  1),
+    'UP_RIGHT':   (-1,  1),
+    'DOWN_RIGHT': ( 1,  1),
+    'UP_LEFT':    (-1, -1),
+    'DOWN_LEFT':  ( 1, -1),
+}
+
+# Visited levels kept in LevelCache
+LIVELEVELS   =  3  # As Level instances
+STOREDLEVELS = 30  # Compressed, older ones are regenerated on revisit
+
+# User key bindings, overriding the defaults. See input.load_bindings()
+BINDINGSFILE = os.path.join(g.CONFIGDIR, "keys.conf")
+
+_keymap = None  # Compiled keymap, see keymap()
+
+
+def commands():
+    '''Return the default bindings as {command: (handler, args, keys)}
+        Handlers are Level methods, called as handler(level, *args)
+    '''
+    cmds = {
+        'quit':       (Level.cmd_quit,       (), (ord('Q'),)),
+        'save':       (Level.cmd_save,       (), (ord('S'),)),
+        'resize':     (Level.cmd_resize,     (), (input.KEY.RESIZE,)),
+        'esc':        (Level.cmd_esc,        (), (input.KEY.ESC,)),
+        'macro':      (Level.cmd_macro,      (), (input.KEY.ALT_F9,)),
+        'remessage':  (Level.cmd_remessage,  (), (input.ctrl('R'),)),
+        'rest':       (Level.cmd_rest,       (), (ord('.'),)),
+        'inventory':  (Level.cmd_inventory,  (), (ord('i'),)),
+        'upstairs':   (Level.cmd_upstairs,   (), (ord('<'),)),
+        'downstairs': (Level.cmd_downstairs, (), (ord('>'),)),
+        'ignore':     (Level.cmd_ignore,     (), (ord(' '),)),
+    }
+    for name in input.MOVE.members():
+        cmds['move_' + name.lower()] = (Level.cmd_move,
+                                        DIRECTIONS[name],
+                                        input.MOVE[name])
+    return cmds
+
+
+def keymap(path=None):
+    '''Return the {keycode: (handler, args)} dispatch table
+        Compiled on first call from commands() and the user bindings file,
+        BINDINGSFILE, where each command listed replaces all its default
+        keys, and its keys are taken from any command they were default for.
+        Giving a bindings file <path> recompiles it from that file
+    '''
+    global _keymap
+    if _keymap is not None and path is None:
+        return _keymap
+
+    cmds = commands()
+    user = {}
+    for name, keys in input.load_bindings(path or BINDINGSFILE).items():
+        if name not in cmds:
+            log.warning("Unknown command in key bindings: %s", name)
+            continue
+        user[name] = keys
+
+    # Defaults first, then user bindings, so these win over default keys
+    owners = {}
+    for name, (__, __, keys) in cmds.items():
+        if name not in user:
+            owners.update((key, name) for key in keys)
+    for name, keys in user.items():
+        for key in keys:
+            if owners.get(key, name) != name and owners[key] not in user:
+                log.warning("Key %s of command %s replaces default command %s",
+                            input.unctrl(key) if key < 256 else key,
+                            name, owners[key])
+            owners[key] = name
+
+    table = {}
+    for key, name in owners.items():
+        handler, args, __ = cmds[name]
+        table[key] = (handler, args)
+
+    _keymap = table
+    return table
+
+
 class Game(object):
 
-    def __init__(self, screen):
+    def __init__(self, screen, autosave=None, prefetch=True):
+        '''<autosave>: by default only for interactive screens, as headless
+            games, such as tests and benchmarks, may run side by side and
+            would all share the same autosave file
+        '''
         self.screen   = screen  # window.Screen instance to draw
         self.player   = None    # player.Player instance
         self.level    = None    # Level instance of current level
-        self.rng      = None    # current RNG state, may be used on save/load
+        self.rng      = None    # rnd.Rng instance, its state may be used on save/load
         self.maxlevel = 0       # deepest level player has reached
+        self.levels   = None    # LevelCache of visited levels, except current
+
+        # savegame.Autosave instance, if enabled
+        if autosave is None:
+            autosave = not isinstance(screen, headless.Screen)
+        self.autosave = save.Autosave(self) if autosave else None
+
+        # Prefetch instance generating the next level, if enabled
+        self.prefetch = Prefetch(self) if prefetch else None
+
+        self.daemons  = None    # daemons.Scheduler, run by Level.tick()
 
     def new(self, seed=None):
         '''Initialize all names and materials, seed the random generator,
@@ -127,12 +290,15 @@ class Game(object):
         '''
         # For reproductible results, initialize the RNG before instancing
         # any object, as Player and Level use the RNG in their initializations
-        rnd.seed(seed)
-        self.rng = rnd.get_state()
+        self.rng = rnd.Rng(seed)
 
         self.maxlevel = 1
-        self.player = Player(g.PLAYERNAME, self.screen)
-        self.level = Level(self.maxlevel, self.screen, self.player)
+        self.player = Player(g.PLAYERNAME, self.screen, self.rng)
+        self.start_daemons()
+        self.level = None
+        self.levels = LevelCache()
+        self.cancel_prefetch()
+        self.enter_level(self.maxlevel)
 
         # DOS 1.1: "Hello {}%s", ", Welcome to the Dungeons of Doom"
         # DOS: Had an extra space before 'Welcome', probably a typo
@@ -141,14 +307,38 @@ class Game(object):
                             self.player.name)
 
     def load(self, savegame):
-        # load file and set all attributes that new() does
-        rnd.seed()  # fake
-        state = rnd.get_state()  # also fake
+        '''Load a savegame file and set all attributes that new() does'''
+        data = save.load(savegame)
 
-        rnd.set_state(state)
-        self.player = Player("Loaded Game", self.screen)
-        self.maxlevel = 15
-        self.level = Level(self.maxlevel, self.screen, self.player)
+        if data.dungeon.size != self.screen.playarea.size:
+            raise g.GameError("Savegame map size {} does not match screen {}".
+                              format(data.dungeon.size,
+                                     self.screen.playarea.size))
+
+        try:
+            self.rng = rnd.Rng(1)
+            self.maxlevel = data.game['maxlevel']
+
+            self.player = Player(data.player['name'], self.screen, self.rng)
+            for k, v in data.player.items():
+                setattr(self.player, k, v)
+
+            # After Player, as it uses the RNG in its initialization
+            self.rng.set_state(data.game['rng'])
+
+            self.start_daemons()
+            self.daemons.set_state(data.game['daemons'])
+
+            # Visited levels are not saved, and are regenerated on revisit
+            self.levels = LevelCache()
+            self.cancel_prefetch()
+            self.level = self.restore_level(data.level, data.dungeon)
+        except (KeyError, ValueError,
+                AttributeError, TypeError) as e:  # missing or mistyped fields
+            raise g.GameError("Invalid savegame {}: {}".format(savegame, e))
+
+        self.level.enter(self.player.row, self.player.col)
+        self.start_prefetch()
 
         self.screen.msgterse("{}, Welcome back!",
                             "Hello {}, Welcome back to the Dungeons of Doom!",
@@ -163,111 +353,400 @@ class Game(object):
                     raise g.Win()
 
                 self.maxlevel = max(nextlevel, self.maxlevel)
-                self.level = Level(nextlevel, self.screen, self.player)
+                self.enter_level(nextlevel)
 
         except g.Win as e:
+            self.gameover()
             self.win()
 
+        except g.Save as e:
+            self.save()
+
         except g.Lose as e:
+            self.gameover()
             self.death(e)
 
+        finally:
+            if self.autosave is not None:
+                self.autosave.close()
+
+    def start_daemons(self):
+        '''Create the scheduler and start the daemons, as DOS init_player()
+            and new_level(). Registration order is run order on each turn
+        '''
+        self.daemons = daemons.Scheduler()
+        self.daemons.turn = self.player.turns
+        self.daemons.daemon('heal', lambda: self.player.heal(),
+                            batch=(lambda n: self.player.heal_horizon(n),
+                                   lambda n: self.player.heal_many(n)))
+        self.daemons.daemon('digest', lambda: self.player.digest(),
+                            batch=(lambda n: self.player.digest_horizon(n),
+                                   lambda n: self.player.digest_many(n)))
+        self.daemons.daemon('monsters', lambda: self.level.move_monsters(),
+                            batch=(lambda n: 0 if self.level.monsters else n,
+                                   lambda n: None))
+
+    def enter_level(self, depth):
+        '''Leave the current level, if any, and enter level <depth>,
+            taken from the level cache if visited before
+        '''
+        if self.level is not None:
+            self.levels.add(self.level)
+
+        level = self.levels.take(depth)
+        if level is None and self.prefetch is not None:
+            level = self.prefetch.take(depth)
+        if level is None:
+            level = Level(depth, self.screen, self.player, self.rng,
+                          autosave=self.autosave, daemons=self.daemons)
+        elif not isinstance(level, Level):
+            level = self.restore_level(*level)
+
+        self.level = level
+        self.level.enter()
+        self.start_prefetch()
+
+    def start_prefetch(self):
+        '''Start generating the level below the current one, if not visited'''
+        depth = self.level.level + 1
+        if (self.prefetch is not None and depth <= MAXLEVEL
+                and depth not in self.levels):
+            self.prefetch.start(depth)
+
+    def cancel_prefetch(self):
+        if self.prefetch is not None:
+            self.prefetch.cancel()
+
+    def restore_level(self, data, dungeon):
+        '''Build a Level from savegame.decode_level() data and its map'''
+        level = Level(data['level'], self.screen, self.player, self.rng,
+                      dungeon=dungeon, autosave=self.autosave,
+                      daemons=self.daemons)
+        level.rng.set_state(data['rng'])
+        level.rooms    = [Room(**room) for room in data['rooms']]
+        level.start    = tuple(data['start'])
+        level.items    = data['items']
+        level.monsters = data['monsters']
+        if len(data['seen']) != len(level.seen):
+            # Slice assignment would silently resize it
+            raise ValueError("seen cells do not match map size")
+        level.seen[:]  = data['seen']
+        level.index_floor()
+        return level
+
+    def save(self, path=None):
+        '''Save the game, by default to savegame.SAVEFILE'''
+        path = path or save.SAVEFILE
+        save.save(path, self)
+        self.screen.message("Game saved to {}", "", path)
+        input.getch(self.screen)
+
+    def gameover(self):
+        '''Nothing left to resume: remove the autosave'''
+        if self.autosave is not None:
+            self.autosave.discard()
+
     def win(self):
+        self.screen.playarea.flush()
         self.screen.message("You win, congratulations!!")
         input.getch(self.screen)
 
     def death(self, msg=None):
+        self.screen.playarea.flush()
         self.screen.message("You're dead! {}", "",
                             msg or "")
         input.getch(self.screen)
 
 
+class LevelCache(object):
+    '''Visited levels by depth, so revisits are instant and memory is flat
+
+        The <live> most recently left levels are kept as Level instances.
+        Older ones are compressed, keeping up to <stored> of them. Least
+        recently used levels are evicted first, and if revisited they are
+        regenerated from their seed, losing any changes made by the player.
+    '''
+    def __init__(self, live=LIVELEVELS, stored=STOREDLEVELS):
+        self.maxlive   = live
+        self.maxstored = stored
+        self.live   = collections.OrderedDict()  # depth: Level
+        self.stored = collections.OrderedDict()  # depth: (data, zlib'd map)
+
+    def __len__(self):
+        return len(self.live) + len(self.stored)
+
+    def __contains__(self, depth):
+        return depth in self.live or depth in self.stored
+
+    def add(self, level):
+        '''Cache a level, evicting least recently used ones if needed'''
+        self.stored.pop(level.level, None)
+        self.live.pop(level.level, None)
+        self.live[level.level] = level
+
+        while len(self.live) > self.maxlive:
+            depth, old = self.live.popitem(last=False)
+            self.stored[depth] = (save.encode_level(old),
+                                  zlib.compress(old.dungeon.tobytes()))
+
+        while len(self.stored) > self.maxstored:
+            self.stored.popitem(last=False)
+
+    def take(self, depth):
+        '''Remove and return level <depth> from the cache: a Level if live,
+            a (savegame.decode_level() data, map grid) tuple if stored,
+            or None if not cached
+        '''
+        if depth in self.live:
+            return self.live.pop(depth)
+
+        if depth in self.stored:
+            data, dungeon = self.stored.pop(depth)
+            rows, cols = data['size']
+            return (save.decode_level(data),
+                    grid.Grid.frombuffer(rows, cols,
+                                         bytearray(zlib.decompress(dungeon))))
+
+        return None
+
+
+class Prefetch(object):
+    '''Generate a level in a background thread, ahead of the player
+
+        Level generation only depends on the game seed and the level depth,
+        as each level uses its own RNG substream, so a prefetched level is
+        identical to one generated on demand. Taking a level still being
+        generated waits for it, which is never slower than generating it.
+    '''
+    def __init__(self, game):
+        self.game   = game
+        self.depth  = None  # Level being prefetched
+        self.result = None  # List holding the Level when done
+        self.thread = None
+
+    def start(self, depth):
+        '''Start generating level <depth>, dropping any other prefetch'''
+        if depth == self.depth:
+            return
+        self.depth = depth
+        self.result = []
+        self.thread = threading.Thread(target=self._generate,
+                                       args=(depth, self.result),
+                                       name="prefetch")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def take(self, depth):
+        '''Return the prefetched level <depth>, or None if not prefetched'''
+        if depth != self.depth:
+            return None
+        self.thread.join()
+        level = self.result[0] if self.result else None
+        self.cancel()
+        return level
+
+    def cancel(self):
+        '''Drop the current prefetch. Its thread finishes unattended'''
+        self.depth = self.result = self.thread = None
+
+    def _generate(self, depth, result):
+        game = self.game
+        try:
+            result.append(Level(depth, game.screen, game.player, game.rng,
+                                autosave=game.autosave,
+                                daemons=game.daemons))
+        except Exception:
+            # Not fatal, the level will be generated on demand
+            log.exception("Prefetching level %d failed", depth)
+
+
+class Room(object):
+    '''A rectangular room in the dungeon, walls included
+
+        Gone rooms have no walls or floor, just a single tunnel cell at
+        <row>, <col> where their corridors meet
+    '''
+    def __init__(self, row, col, rows=1, cols=1, gone=False, dark=False):
+        self.row  = row
+        self.col  = col
+        self.rows = rows
+        self.cols = cols
+        self.gone = gone
+        self.dark = dark
+
+    @property
+    def pos(self):
+        return (self.row, self.col)
+
+    @property
+    def size(self):
+        return (self.rows, self.cols)
+
+
 class Level(object):
-    def __init__(self, level, screen, player):
+    def __init__(self, level, screen, player, rng, dungeon=None,
+                 autosave=None, daemons=None):
         self.level = level
         self.screen = screen
         self.player = player
+        self.autosave = autosave  # savegame.Autosave instance, if enabled
+        self.daemons = daemons    # daemons.Scheduler of the game, if any
+
+        # Levels use their own RNG substream, derived from the game seed and
+        # level depth, so any level can be generated on demand and
+        # independently of the game stream, which is shared with the player
+        # and owns the slots before. See GAMESLOTS
+        self.rng = rng.derive(GAMESLOTS + level - 1, LEVELDRAWS)
 
         self.rows, self.cols = self.screen.playarea.size
 
-        self.dungeon  = {}  # the map
+        self.dungeon  = dungeon  # the map
+        self.rooms    = []       # Room instances, MAXROOMS in grid order
+        self.start    = None     # Player position when entering the level
+        self.floor    = []       # grid.CellSet of free floor cells, per room
+        self.seen     = bytearray(self.rows * self.cols)  # 1 if ever seen
+
+        # Field of view, see look()
+        self.visible  = frozenset()  # Cells the player sees now
+        self.region   = None     # Lit room the player is in, if any
+        self.roomview = {}       # Cached visible cells of each lit room
+        self.opaque   = None     # Cached mask(FLAG.BLOCKS_SIGHT)
+
+        self.distances = None    # chase.DistanceMap to the player
         self.items    = {}
         self.monsters = {}
 
-        for coord in ((row, col)
-                      for col in range(self.rows)
-                      for row in range(self.cols)):
-            self.dungeon[coord] = things.Item()
-
-        self.dungeon = [[TILE.NOTHING] * self.cols for __ in range(self.rows)]
+        # Restored levels come with a map
+        if self.dungeon is None:
+            self.dungeon = grid.Grid(self.rows, self.cols, TILE.NOTHING)
 
-        # create rooms, monsters, etc
-        self.dig_dungeon()
-        self.put_stairs()
-        self.light_room()
+            # create rooms, monsters, etc
+            self.dig_dungeon()
+            self.put_stairs()
+            self.start = self.random_floor()
 
-        # position the player
+    def enter(self, row=None, col=None):
+        '''Place the player in this level, by default at its start position,
+            and draw it
+        '''
         self.player.level = self
-        self.player.row = int((self.rows - 2) / 2)
-        self.player.col = int((self.cols - 2) / 2)
+        if row is None:
+            row, col = self.start
+        self.player.row = row
+        self.player.col = col
+
+        self.visible = frozenset()
+        self.region = None
+        self.draw_map()
+        self.look()
         self.draw(self.player)
 
     def play(self):
+        commands = keymap()
         while True:
+            # Fainted, asleep or frozen: turns pass with no player action
+            while self.player.skipturns > 0:
+                self.player.skipturns -= 1
+                self.tick()
+
             self.screen.update(self.player, self.level)
 
             ch = input.getch(self.screen.playarea)
             self.screen.clear_message()
 
-            if ch == ord('Q'):
-                raise g.Lose("Quit")
+            try:
+                handler, args = commands[ch]
+            except KeyError:
+                self.screen.message("Illegal command '{}', ch={}", "",
+                                    input.unctrl(ch), ch)
+                continue
 
-            elif ch == input.KEY.RESIZE:
-                self.screen.message("Terminal resized")
-                print("\x1b[8;25;80t")
-                input.getch(self.screen.playarea)
+            # Commands return the next level number to leave this one
+            nextlevel = handler(self, *args)
+            if nextlevel is not None:
+                return nextlevel
 
-            elif ch == input.KEY.ESC:     self.screen.message("ESC")
-            elif ch == input.KEY.ALT_F9:  self.screen.message("Set macro")
-            elif ch == input.ctrl('R'):   self.screen.message("Re-message")
+    # COMMANDS ###########
 
-            elif ch in input.MOVE.LEFT:       self.player.move( 0, -1)  # Left
-            elif ch in input.MOVE.DOWN:       self.player.move( 1,  0)  # Down
-            elif ch in input.MOVE.UP:         self.player.move(-1,  0)  # Up
-            elif ch in input.MOVE.RIGHT:      self.player.move( 0,  1)  # Right
-            elif ch in input.MOVE.UP_RIGHT:   self.player.move(-1,  1)  # Up Right
-            elif ch in input.MOVE.DOWN_RIGHT: self.player.move( 1,  1)  # Down Right
-            elif ch in input.MOVE.UP_LEFT:    self.player.move(-1, -1)  # Up Left
-            elif ch in input.MOVE.DOWN_LEFT:  self.player.move( 1, -1)  # Down Left
+    def cmd_quit(self):
+        raise g.Lose("Quit")
 
-            elif ch == ord('.'): self.player.rest()
-            elif ch == ord('i'): self.player.show_inventory()
+    def cmd_save(self):
+        raise g.Save()
 
-            elif ch == ord('<'):
-                if self.check_stairs(down=False):
-                    return self.level - 1
+    def cmd_resize(self):
+        self.screen.message("Terminal resized")
+        print("\x1b[8;25;80t")
+        input.getch(self.screen.playarea)
 
-            elif ch == ord('>'):
-                if self.check_stairs(down=True):
-                    return self.level + 1
+    def cmd_esc(self):       self.screen.message("ESC")
+    def cmd_macro(self):     self.screen.message("Set macro")
+    def cmd_remessage(self): self.screen.message("Re-message")
 
-            elif ch == ord(' '):
-                pass  # ignore spaces. Can be used to dismiss messages
+    def cmd_move(self, dr, dc):
+        self.player.move(dr, dc)
 
-            else:
-                self.screen.message("Illegal command '{}', ch={}", "",
-                                    input.unctrl(ch), ch)
+    def cmd_rest(self):
+        self.player.rest()
+
+    def cmd_inventory(self):
+        self.player.show_inventory()
+
+    def cmd_upstairs(self):
+        if self.check_stairs(down=False):
+            return self.level - 1
+
+    def cmd_downstairs(self):
+        if self.check_stairs(down=True):
+            return self.level + 1
+
+    def cmd_ignore(self):
+        pass  # ignore spaces. Can be used to dismiss messages
 
     def tick(self):
         '''Advance the world one tick (turn)
             some commands, like rest, search or successful move trigger this
             others like see inventory, help or failed move do not
         '''
-        self.player.heal()
-        self.player.digest()
-        # auto-search
-        # create wander monsters
-        # move monsters
-        # ...
+        self.player.turns += 1
+
+        # Heal, digest, move monsters, etc, only the ones due this turn
+        if self.daemons is not None:
+            self.daemons.run(self.player.turns)
+
+        # Between turns, a consistent state to snapshot
+        if self.autosave is not None:
+            self.autosave.tick()
+
+    def pass_turns(self, turns, until=None, horizon=None):
+        '''Let <turns> turns pass, same as calling tick() for each of them,
+            but jumping over the ones where no daemon or fuse does anything
+            but closed-form work, see daemons.Scheduler.idle().
+
+            Stop early if <until>() is true after a turn. Turns are only
+            jumped over within <horizon>(n), how many of the next n turns
+            <until>() is sure to stay false. With <until> but no <horizon>,
+            every turn is ticked, so it never overshoots.
+
+            Fainting also stops it, as in DOS, leaving Player.skipturns for
+            Level.play() to consume as usual.
+        '''
+        end = self.player.turns + turns
+        while self.player.turns < end:
+            if self.daemons is not None and self.player.skipturns == 0:
+                limit = end - self.player.turns - 1
+                if until is not None:
+                    limit = horizon(limit) if horizon is not None else 0
+                idle = self.daemons.idle(limit)
+                if idle:
+                    self.daemons.batch(idle)
+                    self.player.turns += idle
+                    if self.autosave is not None:
+                        self.autosave.tick(idle)
+
+            self.tick()
+            if self.player.skipturns > 0 or (until is not None and until()):
+                break
 
     def draw(self, thing):
         '''Draw something at its current position'''
@@ -276,8 +755,16 @@ class Level(object):
                                   thing.char)
 
     def reveal(self, row, col):
-        '''Draw tile char at (row, col)'''
-        self.screen.playarea.draw(row, col, self.dungeon[row][col])
+        '''Draw what is at (row, col): a monster if in view, otherwise the
+            tile char if ever seen
+        '''
+        if (row, col) in self.monsters and (row, col) in self.visible:
+            char = self.monsters[row, col].char
+        elif self.seen[row * self.cols + col]:
+            char = self.dungeon[row, col]
+        else:
+            char = TILE.NOTHING
+        self.screen.playarea.draw(row, col, char)
 
     def is_passable(self, row, col):
         if not (0 <= row < self.rows and
@@ -285,11 +772,142 @@ class Level(object):
             log.warn("Trying to move outside bounds: %d, %d", row, col)
             return False
 
-        return self.dungeon[row][col] not in TILE.WALL
+        return bool(TILEFLAGS[self.dungeon.code(row, col)] & FLAG.WALKABLE)
+
+    def mask(self, flag):
+        '''Return a bytearray with 1 for each map cell with the given flag,
+            0 otherwise, in the same layout as the map grid
+        '''
+        return self.dungeon.translate(flagmask(flag))
 
     def dig_dungeon(self):
-        self.dig_room((0, 0),
-                      (self.rows, self.cols))
+        '''Dig rooms, corridors and traps, as DOS new_level()'''
+        self.dig_rooms()
+        self.dig_passages()
+        self.index_floor()
+        self.put_traps()
+
+    def dig_rooms(self):
+        '''Dig a room in each block of a 3 x 3 grid, leaving some out,
+            as DOS do_rooms()
+        '''
+        rng = self.rng
+        brows, bcols = self.rows // 3, self.cols // 3  # block size
+
+        gone = set()
+        for __ in range(rng.rnd(4)):
+            i = rng.rnd(MAXROOMS)
+            while i in gone:
+                i = rng.rnd(MAXROOMS)
+            gone.add(i)
+
+        for i in range(MAXROOMS):
+            top, left = (i // 3) * brows, (i % 3) * bcols + 1
+
+            if i in gone:
+                self.rooms.append(Room(top + rng.rnd(brows - 2) + 1,
+                                       left + rng.rnd(bcols - 3) + 1,
+                                       gone=True))
+                continue
+
+            dark = rng.rnd(10) < self.level - 1
+            rows = rng.rnd(brows - 4) + 4
+            cols = rng.rnd(bcols - 4) + 4
+            room = Room(top + rng.rnd(brows - rows),
+                        left + rng.rnd(bcols - cols),
+                        rows, cols, dark=dark)
+            self.rooms.append(room)
+            self.dig_room(room.pos, room.size)
+
+    def dig_passages(self):
+        '''Connect all rooms with corridors, as DOS do_passages():
+            a random spanning tree of adjacent rooms, plus a few extra
+            corridors making loops
+        '''
+        rng = self.rng
+
+        def pick(candidates):
+            # Uniformly random candidate, or None. Same draws as DOS
+            choice = None
+            for j, candidate in enumerate(candidates, 1):
+                if rng.rnd(j) == 0:
+                    choice = candidate
+            return choice
+
+        connected = [set() for __ in range(MAXROOMS)]
+
+        room = rng.rnd(MAXROOMS)
+        ingraph = {room}
+        while len(ingraph) < MAXROOMS:
+            other = pick([_ for _ in NEIGHBOURS[room] if _ not in ingraph])
+            if other is None:
+                room = rng.rnd(MAXROOMS)
+                while room not in ingraph:
+                    room = rng.rnd(MAXROOMS)
+                continue
+            ingraph.add(other)
+            self.dig_passage(room, other)
+            connected[room].add(other)
+            connected[other].add(room)
+
+        for __ in range(rng.rnd(5)):
+            room = rng.rnd(MAXROOMS)
+            other = pick([_ for _ in NEIGHBOURS[room]
+                          if _ not in connected[room]])
+            if other is not None:
+                self.dig_passage(room, other)
+                connected[room].add(other)
+                connected[other].add(room)
+
+    def dig_passage(self, r1, r2):
+        '''Dig a corridor between two adjacent rooms, as DOS conn():
+            from a door in one to a door in the other, straight but for
+            a single turn at a random spot
+        '''
+        rng = self.rng
+        r1, r2 = min(r1, r2), max(r1, r2)
+        src, dst = self.rooms[r1], self.rooms[r2]
+
+        # Main axis of the corridor: 0 for down, 1 for right
+        axis = 0 if r2 != r1 + 1 else 1
+        side = 1 - axis
+
+        start, end = list(src.pos), list(dst.pos)
+        if not src.gone:
+            start[axis] += src.size[axis] - 1
+            start[side] += rng.rnd(src.size[side] - 2) + 1
+        if not dst.gone:
+            end[side] += rng.rnd(dst.size[side] - 2) + 1
+
+        distance = abs(start[axis] - end[axis]) - 1
+        turnspot = rng.rnd(distance - 1) + 1
+
+        for room, pos in ((src, start), (dst, end)):
+            self.dungeon[pos] = TILE.TUNNEL if room.gone else TILE.DOOR
+
+        if distance < 1:
+            return
+
+        # Three straight legs: along the axis up to the turn spot,
+        # sideways to the end column (or row), then along the axis again
+        first = list(start)
+        first[axis] += 1
+        corner1 = list(start)
+        corner1[axis] += distance - turnspot + 1
+        corner2 = list(corner1)
+        corner2[side] = end[side]
+        stop = list(corner2)
+        stop[axis] += turnspot - 1
+
+        self.dig_tunnel(first, corner1)
+        self.dig_tunnel(corner1, corner2)
+        self.dig_tunnel(corner2, stop)
+
+    def dig_tunnel(self, start, end):
+        '''Dig a straight tunnel between two cells, inclusive'''
+        (srow, scol), (erow, ecol) = start, end
+        self.dungeon.fill(TILE.TUNNEL, (min(srow, erow), min(scol, ecol)),
+                          (abs(srow - erow) + 1, abs(scol - ecol) + 1))
 
     def dig_room(self, topleft, size):
         rows, cols = size
@@ -300,33 +918,134 @@ class Level(object):
         log.debug("Digging room at %r, size %r: (%d, %d)-(%d, %d)",
                   topleft, size, srow, scol, erow, ecol)
 
+        # Floor
+        self.dungeon.fill(TILE.FLOOR, (srow + 1, scol + 1), (rows - 2, cols - 2))
+
         # Horizontal walls
         for row in (srow, erow):
-            self.dungeon[row][scol + 1:ecol] = (cols - 2) * [TILE.HORWALL]
+            self.dungeon.fill(TILE.HORWALL, (row, scol + 1), (1, cols - 2))
 
         # Vertical walls
         for col in (scol, ecol):
-            for row in range(srow + 1, erow):
-                self.dungeon[row][col] = TILE.VERTWALL
+            self.dungeon.fill(TILE.VERTWALL, (srow + 1, col), (rows - 2, 1))
 
         # Corners
-        self.dungeon[srow][scol] = TILE.ULCORNER
-        self.dungeon[srow][ecol] = TILE.URCORNER
-        self.dungeon[erow][scol] = TILE.LLCORNER
-        self.dungeon[erow][ecol] = TILE.LRCORNER
+        self.dungeon[srow, scol] = TILE.ULCORNER
+        self.dungeon[srow, ecol] = TILE.URCORNER
+        self.dungeon[erow, scol] = TILE.LLCORNER
+        self.dungeon[erow, ecol] = TILE.LRCORNER
 
-        # Floor
-        for row in range(srow + 1, erow):
-            for col in range(scol + 1, ecol):
-                self.dungeon[row][col] = TILE.FLOOR
-
-    def light_room(self):
+    def draw_map(self):
+        '''Draw all the cells ever seen, and blank the others'''
         for row in range(self.rows):
-            for col in range(self.cols):
-                self.reveal(row, col)
+            offset = row * self.cols
+            self.screen.playarea.draw_row(row, 0, "".join(
+                char if seen else TILE.NOTHING for char, seen in
+                zip(self.dungeon.text(row),
+                    self.seen[offset:offset + self.cols])))
+
+    # FIELD OF VIEW ###########
+
+    def look(self):
+        '''Update what the player sees, marking cells as seen and redrawing
+            only those whose visibility changed
+
+            As in DOS, lit rooms are seen whole from anywhere inside them,
+            doors and walls included, and everything else only next to the
+            player. So visibility is recomputed only when the player is
+            outside lit rooms or crosses into one.
+        '''
+        pos = (self.player.row, self.player.col)
+        region = self.lit_room(*pos)
+        if region is not None and region == self.region:
+            return
+
+        if region is None:
+            visible = fov.shadowcast(self.opacity(), self.dungeon.size, pos, 1)
+        else:
+            visible = self.room_view(region)
+
+        old, self.visible, self.region = self.visible, visible, region
+        for row, col in visible - old:
+            self.seen[row * self.cols + col] = 1
+        for row, col in visible ^ old:
+            self.reveal(row, col)
+
+    def changed_map(self):
+        '''Reset everything derived from the map, after changing tiles that
+            block sight or movement, such as opening a door
+        '''
+        self.opaque = None
+        self.roomview = {}
+        if self.distances is not None:
+            self.distances.set_walkable(self.mask(FLAG.WALKABLE))
+
+    def opacity(self):
+        '''Cells blocking sight, as mask(FLAG.BLOCKS_SIGHT)
+            Cached, so it must be reset to None if the map changes opacity
+        '''
+        if self.opaque is None:
+            self.opaque = self.mask(FLAG.BLOCKS_SIGHT)
+        return self.opaque
+
+    def room_view(self, i):
+        '''Cells visible inside lit room <i>, walls included, cached'''
+        try:
+            return self.roomview[i]
+        except KeyError:
+            pass
+
+        room = self.rooms[i]
+        center = (room.row + room.rows // 2, room.col + room.cols // 2)
+        cells = fov.shadowcast(self.opacity(), self.dungeon.size, center,
+                               max(room.size))
+        visible = self.roomview[i] = frozenset(
+            (row, col) for row, col in cells
+            if room.row <= row < room.row + room.rows and
+               room.col <= col < room.col + room.cols)
+        return visible
+
+    def distance_map(self):
+        '''Distances to the player, for monsters chasing it
+            Computed at most once per player position, and shared by all
+            monsters, so each of them finds its next step in O(1)
+        '''
+        if self.distances is None:
+            self.distances = chase.DistanceMap(self.mask(FLAG.WALKABLE),
+                                               self.dungeon.size)
+        self.distances.update((self.player.row, self.player.col))
+        return self.distances
+
+    def move_monsters(self):
+        '''Move every monster one step closer to the player
+            Monsters never step on each other, nor yet fight the player
+        '''
+        if not self.monsters:
+            return
+
+        distances = self.distance_map()
+        player = (self.player.row, self.player.col)
+        for pos in list(self.monsters):
+            step = distances.step(pos[0], pos[1], self.monsters)
+            if step is None or step == player:
+                continue
+            self.monsters[step] = self.monsters.pop(pos)
+            self.vacate(pos)
+            self.occupy(step)
+            self.reveal(*pos)
+            self.reveal(*step)
+
+    def lit_room(self, row, col):
+        '''Index of the lit room at (row, col), walls included, or None'''
+        for i, room in enumerate(self.rooms):
+            if (not (room.gone or room.dark) and
+                    room.row <= row < room.row + room.rows and
+                    room.col <= col < room.col + room.cols):
+                return i
+        return None
 
     def check_stairs(self, down=True):
-        if self.dungeon[self.player.row][self.player.col] != TILE.STAIRS:
+        if self.dungeon[self.player.row, self.player.col] != TILE.STAIRS:
             self.screen.message("I see no way {}", "",
                                 "down" if down else "up")
             return False
@@ -335,6 +1054,7 @@ class Level(object):
             if self.level >= g.AMULETLEVEL - 1:
                 if not self.player.has_amulet:
                     self.player.pack.append("AMULET")
+                    self.player.touch('pack')
                 self.screen.message("You have the amulet!")
             return True
 
@@ -345,10 +1065,84 @@ class Level(object):
         self.screen.message("You feel a wrenching sensation in your gut")
         return True
 
+    def put_traps(self):
+        '''Randomly place traps, more likely and numerous on deeper levels'''
+        if self.rng.rnd(10) < self.level:
+            for __ in range(min(self.rng.rnd(self.level // 4) + 1, MAXTRAPS)):
+                self.put_tile(TILE.TRAP)
+
     def put_stairs(self):
-        goodtile = False
-        while not goodtile:
-            row = rnd.rnd(self.rows)
-            col = rnd.rnd(self.cols)
-            goodtile = self.dungeon[row][col] == TILE.FLOOR
-        self.dungeon[row][col] = TILE.STAIRS
+        self.put_tile(TILE.STAIRS)
+
+    def put_tile(self, tile):
+        '''Put a tile on a random free floor cell, return its position'''
+        pos = self.random_floor()
+        self.dungeon[pos] = tile
+        self.occupy(pos)
+        return pos
+
+    # FREE FLOOR INDEX ###########
+
+    def index_floor(self):
+        '''Index the free floor cells of each room, the ones with no
+            feature, item or monster, so placement is a single random pick
+        '''
+        floor = grid.code(TILE.FLOOR)
+        taken = set(self.items) | set(self.monsters)
+        self.floor = []
+        for room in self.rooms:
+            cells = []
+            if not room.gone:
+                left, right = room.col + 1, room.col + room.cols - 1
+                for row in range(room.row + 1, room.row + room.rows - 1):
+                    line = self.dungeon.row(row, left, right).tobytes()
+                    if line.count(floor) == len(line):
+                        cells.extend(zip([row] * len(line),
+                                         range(left, right)))
+                    else:
+                        cells.extend((row, col) for col, tile
+                                     in enumerate(line, left)
+                                     if tile == floor)
+            if taken:
+                cells = [_ for _ in cells if _ not in taken]
+            self.floor.append(grid.CellSet(cells))
+
+    def room_at(self, row, col):
+        '''Index of the room whose floor area contains (row, col), or None'''
+        for i, room in enumerate(self.rooms):
+            if (not room.gone and
+                    room.row < row < room.row + room.rows - 1 and
+                    room.col < col < room.col + room.cols - 1):
+                return i
+        return None
+
+    def occupy(self, pos):
+        '''Remove a cell from the free floor index, when something is put
+            on it: a feature, an item or a monster
+        '''
+        room = self.room_at(*pos)
+        if room is not None:
+            self.floor[room].discard(pos)
+
+    def vacate(self, pos):
+        '''Return a cell to the free floor index if it is free again,
+            such as when a monster leaves it or an item is picked up
+        '''
+        room = self.room_at(*pos)
+        if (room is not None and self.dungeon[pos] == TILE.FLOOR
+                and pos not in self.items and pos not in self.monsters):
+            self.floor[room].add(pos)
+
+    def random_floor(self, avoid=None):
+        '''Random free floor cell of a random room, or None if there is none
+            Rooms are picked first, like DOS rnd_room() and rnd_pos(), but
+            only among those with free cells, so it never retries.
+            The room containing cell <avoid>, such as the player position,
+            is excluded, as for DOS wandering monsters.
+        '''
+        skip = None if avoid is None else self.room_at(*avoid)
+        rooms = [cells for i, cells in enumerate(self.floor)
+                 if cells and i != skip]
+        if not rooms:
+            return None
+        return rooms[self.rng.rnd(len(rooms))].pick(self.rng)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+#    Copyright (C) 2015 Rodrigo Silva (MestreLion) <linux@rodrigosilva.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+'''
+Compact 2D grid of tiles, such as the dungeon map
+
+Tiles are stored as one-byte codes, the ordinal of their (ASCII) char,
+in a single contiguous bytearray in row-major order
+'''
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def code(char):
+    '''Return the tile code of a char'''
+    return ord(char)
+
+
+class Grid(object):
+    def __init__(self, rows, cols, fill=' '):
+        self.rows = rows
+        self.cols = cols
+        self.data = bytearray((code(fill),)) * (rows * cols)
+
+    @classmethod
+    def frombuffer(cls, rows, cols, buffer):
+        '''Grid using the tile codes of a writable buffer, without copying,
+            such as a copy-on-write memory-mapped file section
+        '''
+        data = memoryview(buffer)
+        if len(data) != rows * cols:
+            raise ValueError("Buffer size {} does not match grid {} x {}".
+                             format(len(data), rows, cols))
+        grid = cls.__new__(cls)
+        grid.rows = rows
+        grid.cols = cols
+        grid.data = data
+        return grid
+
+    @property
+    def size(self):
+        return (self.rows, self.cols)
+
+    def index(self, row, col):
+        '''Offset of (row, col) in data'''
+        return row * self.cols + col
+
+    def __getitem__(self, pos):
+        '''Tile char at grid[row, col]'''
+        row, col = pos
+        return chr(self.data[row * self.cols + col])
+
+    def __setitem__(self, pos, char):
+        row, col = pos
+        self.data[row * self.cols + col] = code(char)
+
+    def code(self, row, col):
+        '''Tile code at (row, col)'''
+        return self.data[row * self.cols + col]
+
+    def row(self, row, start=0, stop=None):
+        '''Zero-copy view of tile codes of a row, optionally sliced'''
+        if stop is None:
+            stop = self.cols
+        offset = row * self.cols
+        return memoryview(self.data)[offset + start:offset + stop]
+
+    def text(self, row, start=0, stop=None):
+        '''Tile chars of a row, optionally sliced, as a string'''
+        return self.row(row, start, stop).tobytes().decode('ascii')
+
+    def fill(self, char, topleft=(0, 0), size=()):
+        '''Fill a rectangle with a tile, by default the whole grid'''
+        srow, scol = topleft
+        rows, cols = size or (self.rows - srow, self.cols - scol)
+        if rows < 1 or cols < 1:
+            return
+
+        tile = code(char)
+        start = self.index(srow, scol)
+        if rows <= cols:
+            # One slice assignment per row
+            line = bytearray((tile,)) * cols
+            for offset in range(start, start + rows * self.cols, self.cols):
+                self.data[offset:offset + cols] = line
+        else:
+            # One strided slice assignment per column
+            line = bytearray((tile,)) * rows
+            stop = start + (rows - 1) * self.cols + 1
+            for col in range(cols):
+                self.data[start + col:stop + col:self.cols] = line
+
+    def translate(self, table):
+        '''Map every tile code through a 256-byte <table>, in a single pass
+            Return a new bytearray in the same layout as data, useful for
+            whole-grid masks such as "walkable"
+        '''
+        if isinstance(self.data, bytearray):
+            return self.data.translate(table)
+        return bytearray(self.data).translate(table)
+
+    def view(self):
+        '''Zero-copy read-write memoryview of all tile codes'''
+        return memoryview(self.data)
+
+    def tobytes(self):
+        return bytes(self.data)
+
+    def array(self):
+        '''Zero-copy (rows, cols) NumPy array of tile codes, if available'''
+        if numpy is None:
+            raise ImportError("NumPy is required for Grid.array()")
+        return numpy.frombuffer(self.data,
+                                dtype=numpy.uint8).reshape(self.size)
+
+    def __str__(self):
+        return "\n".join(self.text(row) for row in range(self.rows))
+
+
+class CellSet(object):
+    '''Set of (row, col) cells with O(1) add, discard and random pick
+
+        Cells are kept in a list, with a dict of their list index, built
+        on first use. Removing swaps the last cell into the hole, so order
+        is arbitrary but, for a given sequence of operations, always the same.
+    '''
+    def __init__(self, cells=()):
+        self.cells = list(dict.fromkeys(cells))  # Unique, in order
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = {cell: i for i, cell in enumerate(self.cells)}
+        return self._index
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, cell):
+        return cell in self.index
+
+    def __iter__(self):
+        return iter(self.cells)
+
+    def add(self, cell):
+        if cell not in self.index:
+            self.index[cell] = len(self.cells)
+            self.cells.append(cell)
+
+    def discard(self, cell):
+        i = self.index.pop(cell, None)
+        if i is None:
+            return
+        last = self.cells.pop()
+        if i < len(self.cells):
+            self.cells[i] = last
+            self.index[last] = i
+
+    def pick(self, rng):
+        '''Random cell, using rnd.Rng <rng>. The set must not be empty'''
+        return self.cells[rng.rnd(len(self.cells))]
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+#
+#    Copyright (C) 2015 Rodrigo Silva (MestreLion) <linux@rodrigosilva.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+'''
+Headless, in-memory backend for Screen, Window and TextDialog
+
+No terminal or curses initialization required, allowing games to run
+at full CPU speed for simulations, benchmarks and bots.
+
+Framebuffer mimics the subset of curses window methods used by the game,
+storing cells in compact arrays of char codes and attributes that can be
+read back as text and attribute arrays. Input comes from a queue of keys,
+raising g.NoInput when empty.
+'''
+
+import array
+import collections
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import g
+from . import window
+
+
+log = logging.getLogger(__name__)
+
+
+TABSIZE  = 8        # Same as curses default
+ENCODING = 'cp437'  # Of bytes written to framebuffers
+
+
+def color_pair(n):
+    '''Attribute of color pair <n>, same encoding as curses.color_pair()'''
+    return n << 8
+
+
+def newwin(nlines, ncols, begin_y=0, begin_x=0, keys=None):
+    '''Same as curses.newwin()'''
+    return Framebuffer((nlines, ncols), (begin_y, begin_x), keys=keys)
+
+
+class Framebuffer(object):
+    '''In-memory replacement for a curses window
+
+        Sub-windows created by derwin() share the cells of their parent,
+        just like curses does.
+    '''
+    def __init__(self, size, position=(0, 0), parent=None, keys=None):
+        self.size = size
+        self.position = position  # relative to parent
+        self.parent = parent
+        self.cursor = (0, 0)
+
+        if parent is None:
+            rows, cols = size
+            self.root = self
+            self.width = cols
+            self.origin = 0
+            self.chars = array.array('L', [ord(' ')]) * (rows * cols)
+            self.attrs = array.array('L', [0]) * (rows * cols)
+            self.keys = collections.deque() if keys is None else keys
+        else:
+            self.root = parent.root
+            self.width = parent.width
+            self.origin = parent.origin + parent.width * position[0] + position[1]
+            self.chars = parent.chars
+            self.attrs = parent.attrs
+            self.keys = parent.keys
+
+    # Curses window API
+
+    def derwin(self, nlines, ncols, begin_y, begin_x):
+        return Framebuffer((nlines, ncols), (begin_y, begin_x), parent=self)
+
+    def keypad(self, flag):
+        pass
+
+    def getmaxyx(self):
+        return self.size
+
+    def getbegyx(self):
+        if self.parent is None:
+            return self.position
+        return tuple(map(sum, zip(self.position, self.parent.getbegyx())))
+
+    def getyx(self):
+        return self.cursor
+
+    def move(self, y, x):
+        self.cursor = (y, x)
+
+    def addstr(self, *args):
+        '''addstr([y, x,] str[, attr])'''
+        y, x, text, attr = self._args(args)
+        self._write(y, x, text, attr)
+
+    def addnstr(self, *args):
+        '''addnstr([y, x,] str, n[, attr])'''
+        if len(args) in (2, 3):
+            args = (self.cursor + args)
+        y, x, text, n = args[:4]
+        self._write(y, x, text[:n], args[4] if len(args) > 4 else 0)
+
+    def insstr(self, *args):
+        '''insstr([y, x,] str[, attr]). Does not move the cursor'''
+        y, x, text, attr = self._args(args)
+        rows, cols = self.size
+        text = self._decode(text)[:cols - x]
+        offset = self._offset(y, x)
+        end = self._offset(y, cols)
+        keep = end - offset - len(text)
+        for cells in (self.chars, self.attrs):
+            cells[offset + len(text):end] = cells[offset:offset + keep]
+        self.chars[offset:offset + len(text)] = array.array(
+            'L', map(ord, text))
+        self.attrs[offset:offset + len(text)] = array.array(
+            'L', [attr]) * len(text)
+
+    def delch(self, y, x):
+        rows, cols = self.size
+        offset = self._offset(y, x)
+        end = self._offset(y, cols)
+        for cells, blank in ((self.chars, ord(' ')), (self.attrs, 0)):
+            cells[offset:end - 1] = cells[offset + 1:end]
+            cells[end - 1] = blank
+        self.cursor = (y, x)
+
+    def clrtoeol(self):
+        y, x = self.cursor
+        offset = self._offset(y, x)
+        end = self._offset(y, self.size[1])
+        self.chars[offset:end] = array.array('L', [ord(' ')]) * (end - offset)
+        self.attrs[offset:end] = array.array('L', [0]) * (end - offset)
+
+    def erase(self):
+        for row in range(self.size[0]):
+            self.move(row, 0)
+            self.clrtoeol()
+        self.cursor = (0, 0)
+
+    clear = erase
+
+    def refresh(self):
+        pass
+
+    def noutrefresh(self):
+        pass
+
+    def touchwin(self):
+        pass
+
+    def getch(self):
+        try:
+            return self.keys.popleft()
+        except IndexError:
+            raise g.NoInput("No more keys in the input queue")
+
+    # Read back
+
+    def text(self):
+        '''Contents as a list of strings, one per row'''
+        rows, cols = self.size
+        return ["".join(map(chr, self.chars[offset:offset + cols]))
+                for offset in (self._offset(row, 0) for row in range(rows))]
+
+    def attributes(self):
+        '''Attributes as a list of arrays, one per row'''
+        rows, cols = self.size
+        return [self.attrs[offset:offset + cols]
+                for offset in (self._offset(row, 0) for row in range(rows))]
+
+    def array(self):
+        '''Zero-copy (chars, attrs) NumPy arrays of the whole framebuffer'''
+        if numpy is None:
+            raise ImportError("NumPy is required for Framebuffer.array()")
+        shape = self.root.size
+        return tuple(numpy.frombuffer(cells, dtype=numpy.dtype(cells.typecode)
+                                      ).reshape(shape)
+                     for cells in (self.chars, self.attrs))
+
+    # Helpers
+
+    def _offset(self, y, x):
+        return self.origin + y * self.width + x
+
+    def _decode(self, text):
+        '''Pre-encoded glyphs, such as window.CHARSET.CP437, to str'''
+        if isinstance(text, bytes):
+            return text.decode(ENCODING)
+        return text
+
+    def _args(self, args):
+        '''Normalize ([y, x,] str[, attr]) to (y, x, str, attr)'''
+        if len(args) < 3:
+            args = self.cursor + args
+        return tuple(args) + (0,) * (4 - len(args))
+
+    def _write(self, y, x, text, attr):
+        '''Write text at (y, x), wrapping lines and expanding tabs like
+            curses. Text that would go past the last cell is discarded
+        '''
+        rows, cols = self.size
+        text = self._decode(text)
+        if '\t' in text:
+            text = (x * ' ' + text).expandtabs(TABSIZE)[x:]
+        for char in text:
+            if y >= rows:
+                break
+            offset = self._offset(y, x)
+            self.chars[offset] = ord(char)
+            self.attrs[offset] = attr
+            x += 1
+            if x >= cols:
+                y, x = y + 1, 0
+        self.cursor = (min(y, rows - 1), x)
+
+
+class Screen(window.Screen):
+    def __init__(self, size=(g.ROWS, g.COLS), terse=None, keys=()):
+        if not window.colors:
+            window.init_colors(color_pair)
+        window.Screen.__init__(self, Framebuffer(size), size, terse=terse)
+        self.feed(keys)
+
+    def feed(self, keys):
+        '''Append keys to the input queue. Chars are converted to key codes'''
+        self.window.keys.extend(ord(key) if isinstance(key, str) else key
+                                for key in keys)
+
+    def systembar(self):
+        '''No terminal, no system bar'''
+
+    def doupdate(self):
+        pass
+
+    def dialog(self):
+        return TextDialog(self)
+
+    def text(self):
+        return self.window.text()
+
+    def attributes(self):
+        return self.window.attributes()
+
+
+class TextDialog(window.TextDialog):
+    def newwin(self, size, position):
+        keys = self.parent.window.keys if self.parent is not None else None
+        return newwin(*(size + position), keys=keys)
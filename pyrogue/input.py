@@ -22,13 +22,22 @@ and related curses methods and constants
 
 import os
 import sys
+import atexit
+import collections
 import curses.ascii
 import locale
+import struct
+import threading
+import time
+import logging
 
+from . import g
 # enum from stdlib doesn't allow re-assignments, so we use our custom one
 from . import enum2 as enum
 
 
+log = logging.getLogger(__name__)
+
 if sys.version < '3':
     def b2s(b):
         return b
@@ -82,11 +91,147 @@ def ctrl(c):
     return curses.ascii.ctrl(ord(c))
 
 
+def parse_key(text):
+    '''Return the key code of a key description:
+        a single char, '^X' for Ctrl+X, a KEY member name such as 'F1'
+        or 'KEY_F1', or a decimal key code
+    '''
+    if len(text) == 1:
+        return ord(text)
+    if len(text) == 2 and text.startswith('^'):
+        return ctrl(text[1])
+    if text.isdigit():
+        return int(text)
+    name = text.upper()
+    if name.startswith('KEY_'):
+        name = name[4:]
+    try:
+        return KEY[name]
+    except AttributeError:
+        raise ValueError("Invalid key: {!r}".format(text))
+
+
+def load_bindings(path):
+    '''Read key bindings from a file, return a {command: [keys]} dict
+        Each line is a command name followed by its keys, separated by
+        blanks. See parse_key() for key formats. Blank lines and lines
+        starting with '#' are ignored. Missing file means no bindings.
+    '''
+    bindings = {}
+    try:
+        with open(path) as fp:
+            for lineno, line in enumerate(fp, 1):
+                fields = line.split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+                try:
+                    bindings[fields[0]] = [parse_key(_) for _ in fields[1:]]
+                except ValueError as e:
+                    log.warning("%s:%d: %s", path, lineno, e)
+    except IOError:
+        pass
+    return bindings
+
+
+class Journal(object):
+    '''Keystroke journal: the game RNG seed, followed by every key code and
+        the milliseconds elapsed since the previous key. Compact binary file
+    '''
+    MAGIC   = b'PYRJ'
+    VERSION = 1
+    HEADER  = struct.Struct('<4sBq')  # magic, version, seed
+    RECORD  = struct.Struct('<hI')    # key code, delay in ms
+
+    def __init__(self, seed, keys=(), delays=()):
+        self.seed   = seed
+        self.keys   = list(keys)
+        self.delays = list(delays)
+        self.file   = None
+        self.last   = None  # time of last key written
+
+    @classmethod
+    def create(cls, path, seed):
+        '''Start a new journal file, written as keys are added'''
+        journal = cls(seed)
+        journal.file = open(path, 'wb')
+        journal.file.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, seed))
+        journal.file.flush()
+        journal.last = time.time()
+        return journal
+
+    @classmethod
+    def read(cls, path):
+        with open(path, 'rb') as fp:
+            data = fp.read()
+
+        magic, version, seed = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise g.GameError("Not a {} journal version {}: {}".format(
+                g.APPNAME, cls.VERSION, path))
+
+        # Ignore a truncated last record, as from a crash
+        end = len(data) - (len(data) - cls.HEADER.size) % cls.RECORD.size
+        records = [cls.RECORD.unpack_from(data, offset)
+                   for offset in range(cls.HEADER.size, end, cls.RECORD.size)]
+        return cls(seed, (_[0] for _ in records), (_[1] for _ in records))
+
+    @property
+    def duration(self):
+        '''Recorded session duration, in seconds'''
+        return sum(self.delays) / 1000.0
+
+    def write(self, key):
+        '''Add a key, flushing the file so it survives crashes'''
+        now = time.time()
+        delay = int(1000 * (now - self.last))
+        self.last = now
+        self.keys.append(key)
+        self.delays.append(delay)
+        self.file.write(self.RECORD.pack(key, min(delay, 0xFFFFFFFF)))
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+journal = None  # Journal recording keys read by getch(), see record()
+_replay = None  # Keys to be returned by getch() instead of user input
+
+
+def record(path, seed):
+    '''Journal every key read by getch() from now on'''
+    global journal
+    journal = Journal.create(path, seed)
+    atexit.register(journal.close)
+
+
+def replay(keys):
+    '''Make getch() return the given keys instead of reading user input,
+        raising g.NoInput when exhausted
+    '''
+    global _replay
+    _replay = collections.deque(keys)
+
+
 def getch(window):
     '''Get a character from user. Blocks until input.
-        Wrapper for curses.window.getch()
+        Wrapper for curses.window.getch(), also handling journal
+        recording and replay
     '''
-    return window.window.getch()
+    if _replay is not None:
+        try:
+            ch = _replay.popleft()
+        except IndexError:
+            raise g.NoInput("End of replay")
+    else:
+        ch = window.window.getch()
+
+    if journal is not None:
+        journal.write(ch)
+
+    return ch
 
 
 def unctrl(ch):
@@ -95,58 +240,107 @@ def unctrl(ch):
         Printing characters are left as they are.
         Wrapper for curses.unctrl()
     '''
-    return b2s(curses.unctrl(ch))
+    try:
+        return b2s(curses.unctrl(ch))
+    except curses.error:
+        # curses not initialized, such as in headless mode
+        return curses.ascii.unctrl(ch)
+
+
+LEDS_TTL = 0.25  # Seconds keyboard LED status is cached
 
 
 if os.environ.get('DISPLAY') is None:
 
     is_console = True
 
-    def keyboard_leds():
+    SCRLOCK = 0x01
+    NUMLOCK = 0x02
+    CAPLOCK = 0x04
+
+    _tty = None  # Persistent /dev/tty file descriptor
+
+    def _read_leds():
+        '''Return the keyboard LED bitmask, using a persistent descriptor,
+            or None if LEDs can never be read
+        '''
         import struct
         import fcntl
 
+        global _tty
+
         DEVICE = '/dev/tty'
         KDGETLED = 0x4B31
-        SCRLOCK = 0x01
-        NUMLOCK = 0x02
-        CAPLOCK = 0x04
 
-        leds = 0
         try:
-            fd = os.open(DEVICE, os.O_RDONLY | os.O_NOCTTY)
-            retbytes = fcntl.ioctl(fd, KDGETLED, struct.pack('I', 0))
+            if _tty is None:
+                _tty = os.open(DEVICE, os.O_RDONLY | os.O_NOCTTY)
+                atexit.register(os.close, _tty)
+            retbytes = fcntl.ioctl(_tty, KDGETLED, struct.pack('I', 0))
             [leds] = struct.unpack('I', retbytes)
-        except IOError:  # not a true tty console, but an X11 terminal emulator
-            pass
+        except IOError:  # not a true tty console, such as ENOTTY over ssh
+            return None
 
-        return (("NUM LOCK", bool(leds & NUMLOCK)),
-                ("CAP LOCK", bool(leds & CAPLOCK)),
-                ("SCR LOCK", bool(leds & SCRLOCK)))
+        return leds
 
 
 else:
 
     is_console = False
 
-    def keyboard_leds():
-        import subprocess
+    SCRLOCK = 0x04
+    NUMLOCK = 0x02
+    CAPLOCK = 0x01
 
-        SCRLOCK = 0x04
-        NUMLOCK = 0x02
-        CAPLOCK = 0x01
+    def _read_leds():
+        '''Return the keyboard LED bitmask, as reported by `xset -q`,
+            or None if LEDs can never be read
+        '''
+        import subprocess
 
-        leds = 0
         try:
             for line in (subprocess.check_output(["xset", "-q"]).
                          decode(locale.getpreferredencoding()).
                          split('\n')):
                 if 'LED mask' in line:
-                    leds = int(line.split(' ')[-1])
-                    break
+                    return int(line.split(' ')[-1])
         except subprocess.CalledProcessError:
             pass
+        except OSError:  # no xset
+            return None
+
+        return 0
 
-        return (("NUM LOCK", bool(leds & NUMLOCK)),
-                ("CAP LOCK", bool(leds & CAPLOCK)),
-                ("SCR LOCK", bool(leds & SCRLOCK)))
+
+_leds = 0            # Cached keyboard LED bitmask, None if unavailable
+_leds_time = 0       # When _leds was last refreshed
+_leds_thread = None  # Background thread refreshing _leds, if in-flight
+
+
+def _refresh_leds():
+    '''Read the LEDs once into the cache, see keyboard_leds()'''
+    global _leds, _leds_thread
+    _leds = _read_leds()
+    _leds_thread = None
+
+
+def keyboard_leds():
+    '''Return the keyboard Num/Caps/Scroll Lock LED status
+        Never blocks: values are cached, and once older than LEDS_TTL are
+        refreshed by a single background thread, for the next calls.
+        If LEDs can not be read at all, they are not retried
+    '''
+    global _leds_thread, _leds_time
+    now = time.time()
+    if (_leds is not None and _leds_thread is None and
+            now - _leds_time >= LEDS_TTL):
+        _leds_time = now
+        _leds_thread = threading.Thread(target=_refresh_leds,
+                                        name="keyboard_leds")
+        _leds_thread.daemon = True
+        _leds_thread.start()
+
+    leds = _leds or 0
+    return (("NUM LOCK", bool(leds & NUMLOCK)),
+            ("CAP LOCK", bool(leds & CAPLOCK)),
+            ("SCR LOCK", bool(leds & SCRLOCK)))
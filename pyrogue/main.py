@@ -27,12 +27,16 @@ import curses
 import logging.handlers
 import os
 import sys
+import time
 
 from . import g
 from . import input
+from . import rnd
+from . import things
 from . import window
+from . import headless
 
-from .game import Game
+from .game import Game, Level, MAXLEVEL, DIRECTIONS
 
 
 log = logging.getLogger(__name__)
@@ -45,6 +49,29 @@ def parseargs(argv):
     parser.add_argument('savegame', nargs='?',
                         help="Save game file to load.")
 
+    parser.add_argument('--journal', metavar='FILE',
+                        help="Record every keystroke of a new game to FILE,"
+                             " for later replay.")
+
+    parser.add_argument('--replay', metavar='FILE',
+                        help="Replay a keystroke journal at maximum speed"
+                             " and report turns per second.")
+
+    parser.add_argument('--levels', metavar='N', type=int,
+                        help="Generate N dungeon levels, across seeds and"
+                             " depths, and report levels per second.")
+
+    parser.add_argument('--monsters', metavar='N', type=int,
+                        help="Chase a randomly walking player with N"
+                             " monsters, and report monster moves per"
+                             " second.")
+
+    parser.add_argument('--render', choices=('on', 'off', 'end'),
+                        default='off',
+                        help="Replay rendering: on the terminal, off (in"
+                             " memory), or only the final screen."
+                             " [Default: %(default)s]")
+
     args = parser.parse_args(argv)
 
     return args
@@ -87,6 +114,15 @@ def main(argv=None):
     args = parseargs(argv)
     setuplogging()
 
+    if args.levels is not None:
+        return benchmark(args)
+
+    if args.monsters is not None:
+        return benchmark_chase(args)
+
+    if args.replay:
+        return replay(args)
+
     log.debug("Initializing curses with TERM=%s", os.environ.get("TERM"))
 
     try:
@@ -117,14 +153,7 @@ def init(stdscr, args):
     for color in window.COLOR:  #curses.COLORS):  # @UndefinedVariable
         if not color == window.COLOR.DEFAULT:
             curses.init_pair(color, color, -1)
-            window.colors[color] = curses.color_pair(color)
-
-    # Some adjustments:
-    #curses.init_pair(max(window.COLOR) + 1, -1, -1)
-    #window.colors[window.COLOR.DEFAULT] = curses.color_pair(max(window.COLOR) + 1)
-    window.colors[window.COLOR.BROWN] = window.colors[window.COLOR.YELLOW]
-    window.colors[window.COLOR.YELLOW] |= curses.A_BOLD  # Yellow is Brown in curses (despite the name)
-    window.colors[window.COLOR.BLUE]   |= curses.A_BOLD  # Blue is Light blue in Rogue
+    window.init_colors()
 
     # Cursor: 0=invisible, 1=normal (underline), 2="very visible" (block)
     # Normal cursor is disabled by default in some X11 terminal emulators
@@ -137,13 +166,102 @@ def init(stdscr, args):
 
     screen = window.Screen(stdscr, (g.ROWS, g.COLS))
 
-    game = Game(screen)
-    if args.savegame:
+    return run(screen, args)
+
+
+def run(screen, args):
+    '''Play a new, loaded or replayed game on screen, return the Game'''
+    game = Game(screen, autosave=False if args.replay else None)
+    if args.replay:
+        journal = input.Journal.read(args.replay)
+        input.replay(journal.keys)
+        game.new(journal.seed)
+    elif args.savegame:
         game.load(args.savegame)
     else:
         game.new()
+        if args.journal:
+            input.record(args.journal, game.rng.get_state()[1])
+
+    try:
+        game.play()
+    except g.NoInput:
+        if not args.replay:
+            raise
 
-    game.play()
+    return game
+
+
+def replay(args):
+    '''Replay a keystroke journal, optionally rendering to the terminal,
+        and report its speed
+    '''
+    journal = input.Journal.read(args.replay)
+
+    start = time.time()
+    if args.render == 'on':
+        game = curses.wrapper(init, args)
+    else:
+        screen = headless.Screen((g.ROWS, g.COLS))
+        game = run(screen, args)
+    elapsed = time.time() - start
+
+    if args.render == 'end':
+        print("\n".join(screen.text()))
+
+    turns = game.player.turns
+    print("Replayed {} keys, {} turns in {:.3f} seconds: {:.0f} turns/s"
+          " (recorded session: {:.1f} seconds)".format(
+          len(journal.keys), turns, elapsed, turns / max(elapsed, 1e-9),
+          journal.duration))
+
+
+def benchmark(args):
+    '''Generate levels without playing, for all depths of consecutive seeds,
+        and report their speed
+    '''
+    screen = headless.Screen((g.ROWS, g.COLS))
+
+    start = time.time()
+    for i in range(args.levels):
+        seed, depth = divmod(i, MAXLEVEL)
+        Level(depth + 1, screen, None, rnd.Rng(seed + 1))
+    elapsed = time.time() - start
+
+    print("Generated {} levels in {:.3f} seconds: {:.0f} levels/s".format(
+          args.levels, elapsed, args.levels / max(elapsed, 1e-9)))
+
+
+def benchmark_chase(args, moves=1000):
+    '''Make <moves> random player moves on a level with <args.monsters>
+        monsters chasing the player, and report their speed
+    '''
+    screen = headless.Screen((g.ROWS, g.COLS))
+    game = Game(screen, autosave=False, prefetch=False)
+    game.new(1)
+    level, player = game.level, game.player
+
+    for i in range(args.monsters):
+        pos = level.random_floor(avoid=(player.row, player.col))
+        if pos is None:
+            break
+        level.monsters[pos] = things.Monster(chr(ord('A') + i % 26))
+        level.occupy(pos)
+    monsters = len(level.monsters)
+
+    rng = rnd.Rng(1)
+    directions = list(DIRECTIONS.values())
+    start = time.time()
+    for __ in range(moves):
+        player.move(*directions[rng.rnd(len(directions))])
+    elapsed = time.time() - start
+
+    # Failed moves, against walls, take no turn
+    turns = player.turns
+    print("Chased by {} monsters for {} turns in {:.3f} seconds:"
+          " {:.0f} turns/s, {:.0f} monster moves/s".format(
+          monsters, turns, elapsed, turns / max(elapsed, 1e-9),
+          monsters * turns / max(elapsed, 1e-9)))
 
 
 def start(argv=None):
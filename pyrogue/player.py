@@ -52,12 +52,21 @@ class Player(object):
 
     xplevels = tuple(10*2**xplevels for xplevels in range(19)) + (0,)
 
-    def __init__(self, name, screen=None):
+    # Attributes displayed in the status bar, changes tracked in `changes`
+    tracked = frozenset(('hp', 'hpmax', 'str', 'strmax', 'gold', 'xp', 'xplevel',
+                         'armor', 'food', 'row', 'col', 'pack'))
+
+    def __init__(self, name, screen=None, rng=None):
+        self.changes = set()  # Tracked attributes changed, see pop_changes()
+
         self.name = name
 
         # Input and output
         self.screen = screen
 
+        # Random number generator, defaults to the module-level one
+        self.rng = rng or rnd
+
         # Map and position
         self.level = None
         self.row = 0
@@ -80,11 +89,29 @@ class Player(object):
         self.xplevel = 1       # Experience level
 
         # Food left in stomach. Fixed 1250 in Unix
-        self.food = rnd.spread(1300)
+        self.food = self.rng.spread(1300)
 
         # Condition status and flags
         self.skipturns = 0  # Used by sleep, faint, freeze, etc
 
+        self.turns = 0  # Turns played, see Level.tick()
+
+    def __setattr__(self, name, value):
+        if name in self.tracked:
+            self.changes.add(name)
+        super(Player, self).__setattr__(name, value)
+
+    def touch(self, *names):
+        '''Mark tracked attributes as changed, for in-place changes
+            such as pack.append() that do not trigger __setattr__()
+        '''
+        self.changes.update(names)
+
+    def pop_changes(self):
+        '''Return the tracked attributes changed since last call'''
+        changes, self.changes = self.changes, set()
+        return changes
+
     @property
     def armorclass(self):
         if self.armor is None:
@@ -147,13 +174,16 @@ class Player(object):
         # Update to new position
         self.row = row
         self.col = col
+        self.level.look()
         self.level.draw(self)
 
         self.level.tick()
 
-    def rest(self):
-        '''Do nothing for a turn'''
-        self.level.tick()
+    def rest(self, turns=1, until=None, horizon=None):
+        '''Do nothing for some turns, or until <until>() is true,
+            see Level.pass_turns()
+        '''
+        self.level.pass_turns(turns, until, horizon)
 
     def show_inventory(self):
         dialog = self.screen.dialog()
@@ -166,6 +196,15 @@ class Player(object):
     def heal(self):
         pass
 
+    def heal_horizon(self, turns):
+        '''How many of the next <turns> heal() runs can be batched
+            All of them, as healing is not implemented yet
+        '''
+        return turns
+
+    def heal_many(self, turns):
+        pass
+
     def digest(self):
         '''Deplete food in stomach'''
         # Unix has very different mechanics, specially on fainting and rings
@@ -178,11 +217,11 @@ class Player(object):
 
         if self.food < HUNGER.FAINT:
             # 80% chance to avoid fainting, if not already
-            if self.skipturns > 0 or rnd.perc(80):
+            if self.skipturns > 0 or self.rng.perc(80):
                 return
 
             # Faint for a few turns
-            self.skipturns += rnd.rand(4, 11)  # Harsh!
+            self.skipturns += self.rng.rand(4, 11)  # Harsh!
 
             #@@ Disable running
             #@@ Cancel multiple actions
@@ -197,3 +236,20 @@ class Player(object):
 
         elif self.food < HUNGER.HUNGRY and oldfood >= HUNGER.HUNGRY:
             self.screen.message("You are starting to get hungry")
+
+    def digest_horizon(self, turns):
+        '''How many of the next <turns> digest() runs, at most, would only
+            deplete food, so they can be done at once by digest_many():
+            the ones before the next HUNGER stage. None while fainting or
+            wearing rings, as some have random consumption
+        '''
+        if self.ringleft is not None or self.ringright is not None:
+            return 0
+        for food in (HUNGER.HUNGRY, HUNGER.WEAK, HUNGER.FAINT):
+            if self.food >= food:
+                return min(turns, (self.food - food) // self.metabolism)
+        return 0
+
+    def digest_many(self, turns):
+        '''Same as <turns> digest() runs, at most digest_horizon()'''
+        self.food -= turns * self.metabolism
@@ -20,68 +20,196 @@ Random Number Generator functions
 
 Using the same formulas and similar API as original DOS Rogue
 to produce identical results given the same seed
-"""
-
-import time
 
+The generator state lives in Rng instances, so independent games can
+run side by side. Module-level functions operate on a default instance,
+kept for convenience and backwards compatibility.
 
-_seed = _initial = 1
-
+Batch draws, such as rnd_many() and roll_many(), use NumPy when available
+and fall back to plain loops otherwise. Either way the results are the
+same as repeated scalar calls.
+"""
 
-def seed(seed=None):
-    '''Resets the random number generator with the given seed
-        By default uses current system time as seed
-    '''
-    _seed = _initial = int(seed or time.time())
+import time
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def get_state():
-    '''Return the current state of the RNG generator
-        Currently a 2-tuple (current seed, initial seed)
-    '''
-    return (_seed, _initial)
 
+# Trivia: Magic numbers from 'Remark on Algorithm 266'. Google that ;)
+_MULT = 125
+_MOD  = 2796203
 
-def set_state(state):
-    '''Sets current state of the RNG generator'''
-    global _seed, _initial
-    _seed, _initial = state
+PERIOD = (_MOD - 1) // 2  # Draws before repeating, as 125 is a primitive root
 
+_BLOCK = 2 ** 16  # Draws per chunk of rnd_many(), so _powers stays small
+_powers = None    # NumPy cache of _MULT ** k % _MOD, for k in [1, 2 * _BLOCK]
 
-def rnd(n):
-    '''Pick a random integer in range [0, n)'''
-    if n < 1:
-        return 0
 
-    def _ran():
-        '''Trivia: Magic numbers from 'Remark on Algorithm 266'
-            Google that ;)
+def _mult_powers(count):
+    '''Return a NumPy array of _MULT ** k % _MOD for k in [1, count],
+        count up to 2 * _BLOCK. The cache is built once by doubling,
+        as p[L + k] = p[k] * p[L - 1] % _MOD
+    '''
+    global _powers
+    if _powers is None:
+        powers = numpy.array([_MULT], dtype=numpy.int64)
+        while len(powers) < 2 * _BLOCK:
+            powers = numpy.concatenate((powers,
+                                        powers * int(powers[-1]) % _MOD))
+        _powers = powers[:2 * _BLOCK]
+    return _powers[:count]
+
+
+class Rng(object):
+    '''Random number generator with its own independent state'''
+
+    def __init__(self, seed=None):
+        self._seed = self._initial = 1
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        '''Resets the random number generator with the given seed
+            By default uses current system time as seed
         '''
-        global _seed
-        _seed *= 125
-        _seed %= 2796203
-        return _seed
-
-    return ((_ran() + _ran()) & 0x7fffffff) % n;
-
-
-def rand(a, b):
-    '''Return a random integer in range [a, b]'''
-    return rnd(b - a + 1) + a
-
-
-def perc(n):
-    '''Return True with n% probability'''
-    return rand(1, 100) <= n
+        self._seed = self._initial = int(seed or time.time())
 
+    def get_state(self):
+        '''Return the current state of the RNG generator
+            Currently a 2-tuple (current seed, initial seed)
+        '''
+        return (self._seed, self._initial)
 
-def spread(n):
-    '''Return a random integer in range [n +/- 10%)'''
-    return n - n // 10 + rnd(n // 5)
+    def set_state(self, state):
+        '''Sets current state of the RNG generator'''
+        self._seed, self._initial = state
 
+    def state_after(self, n):
+        '''Return the state the generator would have after <n> rnd() draws,
+            without advancing it. Each draw is 2 steps of a multiplicative
+            LCG, so the new seed is seed * 125 ** 2n mod m, computed in
+            O(log n). Negative <n> seeks backwards.
+        '''
+        if n == 0:
+            return self.get_state()
+        return (self._seed % _MOD * pow(_MULT, 2 * n, _MOD) % _MOD,
+                self._initial)
+
+    def skip(self, n):
+        '''Advance the generator by <n> rnd() draws in O(log n)'''
+        self.set_state(self.state_after(n))
+
+    def substream(self, index, size):
+        '''Return a new generator starting <index> * <size> draws ahead
+            Generators with distinct indexes and at most <size> draws each
+            never overlap, as long as the total fits the generator PERIOD.
+        '''
+        rng = Rng(1)
+        rng.set_state(self.state_after(index * size))
+        return rng
+
+    def derive(self, index, size):
+        '''Return a new generator for substream <index> of the initial seed
+            Same as substream(), but independent of the current state,
+            so the result is always the same for a given initial seed
+        '''
+        rng = Rng(1)
+        rng.set_state((self._initial, self._initial))
+        return rng.substream(index, size)
+
+    def _ran(self):
+        '''Advance the generator one step and return the new state'''
+        self._seed *= _MULT
+        self._seed %= _MOD
+        return self._seed
+
+    def rnd(self, n):
+        '''Pick a random integer in range [0, n)'''
+        if n < 1:
+            return 0
+
+        return ((self._ran() + self._ran()) & 0x7fffffff) % n
+
+    def rand(self, a, b):
+        '''Return a random integer in range [a, b]'''
+        return self.rnd(b - a + 1) + a
+
+    def perc(self, n):
+        '''Return True with n% probability'''
+        return self.rand(1, 100) <= n
+
+    def spread(self, n):
+        '''Return a random integer in range [n +/- 10%)'''
+        return n - n // 10 + self.rnd(n // 5)
+
+    def roll(self, number, sides):
+        '''Roll <number> times a dice of <sides> sides,
+            and return the sum of the rolls
+        '''
+        return sum(self.rnd(sides) + 1 for __ in range(number))
 
-def roll(number, sides):
-    '''Roll <number> times a dice of <sides> sides,
-        and return the sum of the rolls
-    '''
-    return sum(rnd(sides) + 1 for number in range(number))
+    def rnd_many(self, n, count):
+        '''Pick <count> random integers in range [0, n)
+            Same as [rnd(n) for _ in range(count)], but much faster
+            Return a NumPy array if available, otherwise a list
+        '''
+        if n < 1 or count < 1:
+            # rnd() does not advance the generator in this case
+            if numpy is None:
+                return count * [0]
+            return numpy.zeros(max(count, 0), dtype=numpy.int64)
+
+        if numpy is None:
+            return [self.rnd(n) for __ in range(count)]
+
+        # Sums of two states are below 2 ** 23, so any larger n gives the
+        # same results, and is clamped to fit the int64 modulo below
+        n = min(n, 2 ** 31)
+
+        # Draw in chunks of at most _BLOCK, each starting where the previous
+        # one left off, seed * _MULT ** (2 * _BLOCK), so memory is bounded
+        result = numpy.empty(count, dtype=numpy.int64)
+        seed = self._seed % _MOD
+        for start in range(0, count, _BLOCK):
+            size = min(_BLOCK, count - start)
+            states = seed * _mult_powers(2 * size) % _MOD
+            seed = int(states[-1])
+            result[start:start + size] = \
+                ((states[0::2] + states[1::2]) & 0x7fffffff) % n
+        self._seed = seed
+        return result
+
+    def roll_many(self, number, sides, count):
+        '''Roll <count> times <number> dice of <sides> sides
+            Same as [roll(number, sides) for _ in range(count)],
+            but much faster. Return a NumPy array if available,
+            otherwise a list
+        '''
+        count = max(count, 0)
+        number = max(number, 0)
+        rolls = self.rnd_many(sides, number * count)
+
+        if numpy is None:
+            return [sum(rolls[i * number:(i + 1) * number]) + number
+                    for i in range(count)]
+
+        return rolls.reshape(count, number).sum(axis=1) + number
+
+
+# Default generator used by the module-level functions
+_rng = Rng(1)
+
+seed        = _rng.seed
+get_state   = _rng.get_state
+set_state   = _rng.set_state
+rnd         = _rng.rnd
+rand        = _rng.rand
+perc        = _rng.perc
+spread      = _rng.spread
+roll        = _rng.roll
+rnd_many    = _rng.rnd_many
+roll_many   = _rng.roll_many
+skip        = _rng.skip
+state_after = _rng.state_after
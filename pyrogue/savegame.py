@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+#
+#    Copyright (C) 2015 Rodrigo Silva (MestreLion) <linux@rodrigosilva.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+'''
+Savegame file format
+
+A versioned binary file: a header followed by tagged sections.
+    GAME: maxlevel, game RNG state and scheduled daemons and fuses
+    PLAY: player attributes
+    LEVL: current level number, size, RNG state, rooms, items and monsters
+    GRID: current level map, raw tile codes, see grid.Grid
+
+All sections but GRID are compact JSON. GRID is loaded from a
+copy-on-write memory map of the file, so it is never copied unless the
+map is changed, and the file itself is never modified.
+
+Files are written atomically, so a crash never leaves a broken savegame.
+Autosave writes them periodically in a background thread.
+'''
+
+import json
+import logging
+import mmap
+import os.path
+import struct
+import tempfile
+import threading
+import time
+
+from . import g
+from . import grid
+from . import things
+
+
+log = logging.getLogger(__name__)
+
+MAGIC   = b'PYRS'
+VERSION = 1
+HEADER  = struct.Struct('<4sBH')  # magic, version, number of sections
+SECTION = struct.Struct('<4sI')   # tag, payload size
+
+SAVEFILE     = os.path.join(g.CONFIGDIR, "rogue.sav")  # DOS: rogue.sav
+AUTOSAVEFILE = os.path.join(g.CONFIGDIR, "autosave.sav")
+AUTOSAVE     = 100  # Turns between autosaves
+
+# Level.seen flags as text, and back
+SEENTEXT = bytes.maketrans(b'\x00\x01', b'01')
+SEENDATA = bytes.maketrans(b'01', b'\x00\x01')
+
+# Player attributes saved
+PLAYER = ('name', 'row', 'col',
+          'armor', 'weapon', 'ringright', 'ringleft', 'pack',
+          'hp', 'hpmax', 'str', 'strmax', 'gold', 'xp', 'xplevel',
+          'food', 'skipturns', 'turns')
+
+
+class Savegame(object):
+    '''Decoded savegame contents'''
+    def __init__(self, game, player, level, dungeon):
+        self.game    = game     # dict
+        self.player  = player   # dict of PLAYER attributes
+        self.level   = level    # dict
+        self.dungeon = dungeon  # grid.Grid
+
+
+def _encode(thing):
+    '''Make a thing, such as an Item, JSON-serializable'''
+    if thing is None or isinstance(thing, (str, int, float, bool)):
+        return thing
+    if isinstance(thing, (list, tuple)):
+        return [_encode(_) for _ in thing]
+    return {'type': type(thing).__name__,
+            'attrs': {k: _encode(v) for k, v in vars(thing).items()}}
+
+
+def _decode(data):
+    '''Rebuild things encoded by _encode()'''
+    if isinstance(data, list):
+        return [_decode(_) for _ in data]
+    if not isinstance(data, dict):
+        return data
+    cls = getattr(things, data['type'])
+    thing = cls.__new__(cls)
+    thing.__dict__.update({k: _decode(v) for k, v in data['attrs'].items()})
+    return thing
+
+
+def _json(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def encode_level(level):
+    '''Return the LEVL section data of a level, except its map'''
+    return {'level': level.level,
+            'size': level.dungeon.size,
+            'rng': level.rng.get_state(),
+            'rooms': [dict(vars(room)) for room in level.rooms],
+            'start': level.start,
+            'seen': level.seen.translate(SEENTEXT).decode('ascii'),
+            'items': [(row, col, _encode(thing))
+                      for (row, col), thing in level.items.items()],
+            'monsters': [(row, col, _encode(thing))
+                         for (row, col), thing in level.monsters.items()]}
+
+
+def decode_level(data):
+    '''Rebuild, in place, the items, monsters and seen cells of
+        encode_level() data
+    '''
+    data['seen'] = bytearray(data['seen'].encode('ascii')).translate(SEENDATA)
+    for key in ('items', 'monsters'):
+        data[key] = {(row, col): _decode(thing)
+                     for row, col, thing in data[key]}
+    return data
+
+
+def snapshot(game):
+    '''Return the game state as (tag, data) sections, ready for write()
+        Cheap: data are plain copies, unaffected by further play,
+        and serialization is left to write()
+    '''
+    player, level = game.player, game.level
+    return (
+        (b'GAME', {'maxlevel': game.maxlevel,
+                   'rng': game.rng.get_state(),
+                   'daemons': game.daemons.get_state()}),
+        (b'PLAY', {k: _encode(getattr(player, k)) for k in PLAYER}),
+        (b'LEVL', encode_level(level)),
+        (b'GRID', level.dungeon.tobytes()),
+    )
+
+
+def write(path, sections):
+    '''Write snapshot() sections to a savegame file, atomically:
+        to a unique temporary file, synced to disk, then renamed over <path>
+    '''
+    fd, temp = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(path),
+                                dir=os.path.dirname(path) or os.curdir)
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(HEADER.pack(MAGIC, VERSION, len(sections)))
+            for tag, data in sections:
+                payload = data if isinstance(data, bytes) else _json(data)
+                fp.write(SECTION.pack(tag, len(payload)))
+                fp.write(payload)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+
+def save(path, game):
+    write(path, snapshot(game))
+
+
+def load(path):
+    '''Read a savegame file, return a Savegame'''
+    try:
+        with open(path, 'rb') as fp:
+            data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (IOError, ValueError) as e:  # ValueError: empty file
+        raise g.GameError("Could not read savegame {}: {}".format(path, e))
+
+    view = memoryview(data)
+    try:
+        magic, version, count = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError("not a {} savegame".format(g.APPNAME))
+        if version != VERSION:
+            raise ValueError("unsupported version {}".format(version))
+
+        sections = {}
+        offset = HEADER.size
+        for __ in range(count):
+            tag, size = SECTION.unpack_from(view, offset)
+            offset += SECTION.size
+            if offset + size > len(view):
+                raise ValueError("truncated section {!r}".format(tag))
+            sections[tag] = view[offset:offset + size]
+            offset += size
+
+        game, player, level = (json.loads(sections[tag].tobytes().
+                                          decode('utf-8'))
+                               for tag in (b'GAME', b'PLAY', b'LEVL'))
+        dungeon = grid.Grid.frombuffer(level['size'][0], level['size'][1],
+                                       sections[b'GRID'])
+        player = {k: _decode(v) for k, v in player.items()}
+        level = decode_level(level)
+    except (struct.error, KeyError, ValueError,
+            AttributeError, TypeError) as e:  # missing or mistyped fields
+        raise g.GameError("Invalid savegame {}: {}".format(path, e))
+
+    return Savegame(game, player, level, dungeon)
+
+
+class Autosave(object):
+    '''Periodic autosave that never stalls the game
+
+        Every <interval> turns, tick() takes a snapshot() of the game, the
+        only cost paid by the game thread. A background thread serializes
+        and writes it. If the writer is still busy, for example on a disk
+        hiccup, a newer snapshot replaces the pending one, so at most one
+        is ever queued.
+
+        Timings, in seconds, are kept in `stats` for measuring.
+    '''
+    def __init__(self, game, path=AUTOSAVEFILE, interval=AUTOSAVE):
+        self.game     = game
+        self.path     = path
+        self.interval = interval
+        self.turns    = 0
+        self.pending  = None  # Snapshot waiting to be written
+        self.busy     = False  # Writer is writing a snapshot
+        self.closed   = False
+        self.cond     = threading.Condition()
+        self.thread   = None
+        self.stats    = {'saves': 0, 'writes': 0, 'dropped': 0, 'errors': 0,
+                         'snapshot': 0.0, 'snapshot_max': 0.0,
+                         'write': 0.0, 'write_max': 0.0}
+
+    def tick(self, turns=1):
+        '''Count turns, saving every <interval> turns'''
+        old, self.turns = self.turns, self.turns + turns
+        if self.turns // self.interval > old // self.interval:
+            self.save()
+
+    def save(self):
+        '''Snapshot the game and queue it for writing'''
+        start = time.time()
+        sections = snapshot(self.game)
+        self._time('snapshot', time.time() - start)
+
+        with self.cond:
+            self.stats['saves'] += 1
+            if self.pending is not None:
+                self.stats['dropped'] += 1
+            self.pending = sections
+            self.cond.notify()
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._writer,
+                                           name="autosave")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def close(self, timeout=None):
+        '''Write any pending snapshot and stop the writer.
+            Waits at most <timeout> seconds. Return True if all was written
+        '''
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if not self.thread.is_alive():
+                # Allow reuse, a new writer starts on next save()
+                self.thread = None
+                self.closed = False
+        return self.pending is None and not self.busy
+
+    def discard(self):
+        '''Stop autosaving and remove the autosave file, as on game over'''
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _writer(self):
+        while True:
+            with self.cond:
+                while self.pending is None and not self.closed:
+                    self.cond.wait()
+                if self.pending is None:
+                    return
+                sections, self.pending = self.pending, None
+                self.busy = True
+
+            start = time.time()
+            try:
+                write(self.path, sections)
+            except (IOError, OSError) as e:
+                self.stats['errors'] += 1
+                log.error("Autosave failed: %s", e)
+            else:
+                self.stats['writes'] += 1
+            self._time('write', time.time() - start)
+
+            with self.cond:
+                self.busy = False
+
+    def _time(self, key, elapsed):
+        self.stats[key] = elapsed
+        self.stats[key + '_max'] = max(elapsed, self.stats[key + '_max'])
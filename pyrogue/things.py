@@ -163,3 +163,8 @@ class Gold(Item):
     name = "Gold"
     def __init__(self, gold):
         self.gold = gold
+
+
+class Monster(object):
+    def __init__(self, char):
+        self.char = char  # 'A' to 'Z', see game.TILE.MONSTER
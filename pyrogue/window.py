@@ -20,6 +20,7 @@
 import sys
 import operator
 import functools
+import itertools
 import logging
 import time
 import curses
@@ -90,7 +91,65 @@ chars = {
     ' ': (' ', ' ',         0x20, COLOR.BLACK),    # Background
 }
 
-colors = {}  # To be initialized after curses
+class CHARSET(int, enum.Enum):
+    ASCII   = 0  # Index in chars tuples
+    UNICODE = 1
+    CP437   = 2  # Pre-encoded bytes, for terminals using a CP437 font
+
+
+class _Glyphs(dict):
+    '''Map chars to ready (glyph, attributes) pairs, see init_glyphs()'''
+    charset = CHARSET.UNICODE
+
+    def __missing__(self, char):
+        # Unknown chars are drawn as themselves, with default attributes,
+        # encoded like the known ones so runs never mix str and bytes
+        if self.charset == CHARSET.CP437:
+            return (char.encode('cp437', 'replace'), 0)
+        return (char, 0)
+
+
+colors = {}  # To be initialized after curses, see init_colors()
+glyphs = _Glyphs()  # Compiled from chars and colors, see init_glyphs()
+
+
+def init_colors(color_pair=curses.color_pair):
+    '''Map each COLOR to its attributes, using color pair of same number
+        Pairs must be already initialized, see main.init().
+        Headless backends may provide their own <color_pair>
+    '''
+    for color in COLOR:
+        if not color == COLOR.DEFAULT:
+            colors[color] = color_pair(color)
+
+    # Some adjustments:
+    #curses.init_pair(max(COLOR) + 1, -1, -1)
+    #colors[COLOR.DEFAULT] = curses.color_pair(max(COLOR) + 1)
+    colors[COLOR.BROWN] = colors[COLOR.YELLOW]
+    colors[COLOR.YELLOW] |= curses.A_BOLD  # Yellow is Brown in curses (despite the name)
+    colors[COLOR.BLUE]   |= curses.A_BOLD  # Blue is Light blue in Rogue
+
+    init_glyphs()
+
+
+def init_glyphs(charset=CHARSET.UNICODE):
+    '''Compile the glyph table for the given charset. Requires colors.
+        Can be called again to switch charsets. Already drawn windows are
+        not updated, use their clear_shadow() and redraw them.
+        CP437 codes below 0x20, such as the player's 0x01, are C0 controls
+        curses draws as ^A, tab, etc, so those chars use their ASCII glyph
+    '''
+    table = {}
+    for char, c in chars.items():
+        if charset == CHARSET.CP437:
+            glyph = bytes(bytearray((c[2] if c[2] >= 0x20 else ord(c[0]),)))
+        else:
+            glyph = c[charset]
+        table[char] = (glyph, functools.reduce(operator.or_, c[4:],
+                                               colors[c[3]]))
+    glyphs.clear()
+    glyphs.update(table)
+    glyphs.charset = charset
 
 
 def left(  text, width, fill=' '): return align(text, width, fill, "<")
@@ -108,8 +167,18 @@ class Window(object):
         self.position = position
         self.window = self.parent.derwin(*(self.size + self.position))
         self.window.keypad(1)
+        self.clear_shadow()
         log.debug("Window at %r, size %r", position, size)
 
+    def clear_shadow(self):
+        '''Reset damage tracking: forget what was drawn and what is pending
+            Use when the window contents were changed other than by draw()
+        '''
+        cells = self.size[0] * self.size[1]
+        self.shadow  = cells * [None]  # Flushed chars, row-major
+        self.pending = cells * [None]  # Chars to draw on next flush()
+        self.dirty   = set()  # Rows with pending chars
+
     def box(self, position=(), size=()):
         if not position:
             position = (0, 0)
@@ -123,40 +192,73 @@ class Window(object):
         erow, ecol = (position[0] + size[0] - 1,
                       position[1] + size[1] - 1)
 
-        # Horizontal walls
-        char, attrs = self.charattrs("-")
-        self.window.addstr(srow, scol + 1, char * (size[1]-2), attrs)
-        self.window.addstr(erow, scol + 1, char * (size[1]-2), attrs)
+        # Horizontal walls and corners
+        self.draw_runs(srow, scol, "1" + "-" * (size[1]-2) + "2")
+        self.draw_runs(erow, scol, "3" + "-" * (size[1]-2) + "4")
 
         # Vertical walls and floor
-        char, attrs = self.charattrs("|")
-        for row in range(srow + 1, erow):
-            self.window.addstr(row, scol, char, attrs)
-            self.window.addstr(row, ecol, char, attrs)
-
-        # Corners
-        self.window.addstr(srow, scol, *self.charattrs("1"))
-        self.window.addstr(srow, ecol, *self.charattrs("2"))
-        self.window.addstr(erow, scol, *self.charattrs("3"))
-        self.window.insstr(erow, ecol, *self.charattrs("4"))
-
-        # Floor
+        line = "|" + "." * (size[1]-2) + "|"
         for row in range(srow + 1, erow):
-            for col in range(scol + 1, ecol):
-                self.window.addstr(row, col, *self.charattrs('.'))
+            self.draw_runs(row, scol, line)
 
     def charattrs(self, char):
-        if char in chars:
-            c = chars[char]
-            return c[1], functools.reduce(operator.or_, c[4:], colors[c[3]])
+        return glyphs[char]
 
     def draw(self, row, col, char):
+        '''Draw char at (row, col) on next flush()'''
+        self.pending[row * self.size[1] + col] = char
+        self.dirty.add(row)
+
+    def draw_row(self, row, col, chars):
+        '''Draw a sequence of chars starting at (row, col) on next flush()'''
+        chars = chars[:self.size[1] - col]
+        offset = row * self.size[1] + col
+        self.pending[offset:offset + len(chars)] = chars
+        self.dirty.add(row)
+
+    def flush(self):
+        '''Write to the curses window only the pending cells that changed
+            since last flush, and mark it for the next doupdate().
+            Consecutive changed cells are drawn as runs, see draw_runs()
+        '''
+        cols = self.size[1]
+        shadow, pending = self.shadow, self.pending
+        for row in self.dirty:
+            start = row * cols
+            run = []
+            for offset in range(start, start + cols + 1):
+                char = pending[offset] if offset < start + cols else None
+                if char is not None and char != shadow[offset]:
+                    shadow[offset] = char
+                    run.append(char)
+                elif run:
+                    self.draw_runs(row, offset - start - len(run), run)
+                    run = []
+            pending[start:start + cols] = cols * [None]
+        self.dirty.clear()
+        self.window.noutrefresh()
+
+    def draw_runs(self, row, col, chars):
+        '''Write chars starting at (row, col) to the curses window right away
+            Consecutive chars sharing the same attributes are grouped in
+            a single curses call
+        '''
+        for attrs, run in itertools.groupby(map(glyphs.__getitem__, chars),
+                                            key=operator.itemgetter(1)):
+            run = [glyph for glyph, __ in run]
+            text = run[0][:0].join(run)  # str or bytes, depending on charset
+            self.addstr(row, col, text, attrs)
+            col += len(run)
+
+    def addstr(self, row, col, text, attrs):
+        '''Write text at (row, col) to the curses window right away'''
         try:
-            self.window.addstr(row, col, *self.charattrs(char))
+            self.window.addstr(row, col, text, attrs)
         except curses.error:
             # last char of last row, not allowed by curses due to scroll
+            col += len(text) - 1
             self.window.delch( row, col)
-            self.window.insstr(row, col, *self.charattrs(char))
+            self.window.insstr(row, col, text[-1:], attrs)
 
 
 class Screen(Window):
@@ -165,6 +267,8 @@ class Screen(Window):
         self.position = position
         self.size = size
         self.window = stdscr
+        self.clear_shadow()
+        self.cache = {}  # Last drawn values of status and system bars
 
         if terse is None:
             self.terse = self.size[1] <= 40
@@ -187,71 +291,110 @@ class Screen(Window):
                                for __ in sorted(chars,
                                                key=lambda __: chars[__][2])]),
                       self.size[1] - 2)
-        for col, char in enumerate(text, 1):
-            self.window.addstr(2, col, *self.charattrs(char))
+        self.draw_runs(2, 1, text)
+
+    # Player attributes displayed in each status bar line
+    STATUS = frozenset(('hp', 'hpmax', 'str', 'strmax', 'gold', 'armor',
+                        'xplevel', 'xp'))
+    EXTRA  = frozenset(('food', 'row', 'col', 'pack'))
 
     def statusbar(self, player, level):
+        # Only re-render lines whose displayed player attributes changed,
+        # or all of them after invalidate()
+        changes = player.pop_changes()
+        if not self.cache:
+            changes |= self.STATUS | self.EXTRA
+
         # Formatting rationale: all attributes should touch the ':' when
         # at their *typical* value, hence the {:2d} in Level, Hits, Str, etc
         # Gold and XP will always increase line width when up a new power of 10
         # So will the uncommon Armor >= 10 and Hits >= 100
-        msg = ("Level:{:2d}\t"
-               "Hits:{:2d}({:2d})\t"
-               "Str:{:2d}({:2d})\t"
-               "Gold:{}\t"
-               "Armor:{}\t"
-               "Exp:{:2d}/{}".format(
-                level,
-                player.hp,
-                player.hpmax,
-                player.str,
-                player.strmax,
-                player.gold,
-                player.armorclass,
-                player.xplevel,
-                player.xp)).replace('\t', 3 * ' ')
-        self.window.addstr(self.size[0]-2, 0, msg, colors[COLOR.YELLOW])
+        if self.changed('level', level) or changes & self.STATUS:
+            msg = ("Level:{:2d}\t"
+                   "Hits:{:2d}({:2d})\t"
+                   "Str:{:2d}({:2d})\t"
+                   "Gold:{}\t"
+                   "Armor:{}\t"
+                   "Exp:{:2d}/{}".format(
+                    level,
+                    player.hp,
+                    player.hpmax,
+                    player.str,
+                    player.strmax,
+                    player.gold,
+                    player.armorclass,
+                    player.xplevel,
+                    player.xp)).replace('\t', 3 * ' ')
+            self.window.addstr(self.size[0]-2, 0, msg, colors[COLOR.YELLOW])
+            self.window.clrtoeol()
 
         # Extra, temporary status bar
-        msg = ("Food: {:4d}\t"
-               "Pos: ({:2d},{:2d})\t"
-               "Inventory: {}").format(
-                player.food,
-                player.row,
-                player.col,
-                player.pack)
-        self.window.addstr(self.size[0]-3, 0, msg)
-
-        row, col = self.size[0] - 1, 60
-        self.window.addstr(row, col, 10 * ' ')
-        hungerstage = player.hungerstage
-        if hungerstage:
-            self.window.addstr(row, col, hungerstage, curses.A_REVERSE)
+        if changes & self.EXTRA:
+            msg = ("Food: {:4d}\t"
+                   "Pos: ({:2d},{:2d})\t"
+                   "Inventory: {}").format(
+                    player.food,
+                    player.row,
+                    player.col,
+                    player.pack)
+            self.window.addstr(self.size[0]-3, 0, msg)
+            self.window.clrtoeol()
+
+        if 'food' in changes:
+            row, col = self.size[0] - 1, 60
+            hungerstage = player.hungerstage
+            if self.changed('hunger', hungerstage):
+                self.window.addstr(row, col, 10 * ' ')
+                if hungerstage:
+                    self.window.addstr(row, col, hungerstage, curses.A_REVERSE)
+
+    def invalidate(self):
+        '''Forget the last drawn status and system bars, as when their
+            contents were lost, so next update() redraws them in full.
+            Also marks the whole screen and play area for repainting,
+            such as after a dialog window covered them
+        '''
+        self.cache.clear()
+        self.window.touchwin()
+        self.playarea.window.touchwin()
+
+    def changed(self, key, value):
+        '''Return True if <value> differs from the one last seen for <key>,
+            which is then updated. Used to skip redrawing unchanged parts
+        '''
+        if key in self.cache and self.cache[key] == value:
+            return False
+        self.cache[key] = value
+        return True
 
     def systembar(self):
         row, cols = (self.size[0]-1, self.size[1])
 
         # Terminal capabilities (temporary)
-        msg = ("Color:{:5}  "
-               "RGB:{:5}".format(
-                str(curses.has_colors()),
-                str(curses.can_change_color())))
-        self.window.addstr(row, 0, msg, curses.A_REVERSE)
+        if self.changed('caps', None):
+            msg = ("Color:{:5}  "
+                   "RGB:{:5}".format(
+                    str(curses.has_colors()),
+                    str(curses.can_change_color())))
+            self.window.addstr(row, 0, msg, curses.A_REVERSE)
 
         # Keyboard Scroll/Num/Caps Lock led status
-        for i, (led, on) in enumerate(input.keyboard_leds()):
-            width = len(led) + 1
-            self.window.move(row, 25 + width * i)
-            if on:
-                self.window.addstr(led, curses.A_REVERSE)
-            else:
-                self.window.addstr(width * ' ')
+        leds = input.keyboard_leds()
+        if self.changed('leds', leds):
+            for i, (led, on) in enumerate(leds):
+                width = len(led) + 1
+                self.window.move(row, 25 + width * i)
+                if on:
+                    self.window.addstr(led, curses.A_REVERSE)
+                else:
+                    self.window.addstr(width * ' ')
 
         # Current time
         msg = time.strftime("%H:%M")
-        self.window.delch(row, cols-1)
-        self.window.addstr(row, cols - len(msg), msg[:-1], curses.A_REVERSE)
-        self.window.insstr(row, cols - 1,        msg[-1:], curses.A_REVERSE)
+        if self.changed('time', msg):
+            self.window.delch(row, cols-1)
+            self.window.addstr(row, cols - len(msg), msg[:-1], curses.A_REVERSE)
+            self.window.insstr(row, cols - 1,        msg[-1:], curses.A_REVERSE)
 
     def message(self, terse, verbose="", *args, **kwargs):
         '''Display a message in the top bar.
@@ -292,10 +435,17 @@ class Screen(Window):
         self.window.clrtoeol()
 
     def update(self, player, level):
+        '''Redraw only what changed, with a single physical screen update'''
         self.statusbar(player, level)
         self.systembar()
+        self.window.noutrefresh()
+        self.playarea.flush()
         self.playarea.window.move(player.row, player.col)
-        self.window.refresh()
+        self.playarea.window.noutrefresh()
+        self.doupdate()
+
+    def doupdate(self):
+        curses.doupdate()
 
     def dialog(self):
         return TextDialog(self)
@@ -316,11 +466,16 @@ class TextDialog(Window):
                                            if self.parent is not None
                                            else (0, 0))))
 
-        self.window = curses.newwin(*(self.size + self.position))
+        self.window = self.newwin(self.size, self.position)
+
+    def newwin(self, size, position):
+        return curses.newwin(*(size + position))
 
     def addline(self, line, *attrs):
         pass
 
     def show(self):
         self.window.addstr("-Press any key to continue-")
-        self.window.getch()
+        input.getch(self)
+        if self.parent is not None:
+            self.parent.invalidate()